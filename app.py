@@ -2,12 +2,23 @@ import streamlit as st
 from er_evaluation.search import ElasticSearch
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search
-from extraction import run_extraction, simple_extraction_output, convert_assignee_type
+from extraction import run_extraction, simple_extraction_output, normalize_columns
+from snapshot import SNAPSHOT_DIR
+from extraction_old import run_extraction as run_complex_extraction
+from connection import get_engine, query_metrics
+from names import name_variants, name_acronym
+from candidates import CandidateIndex
+from blocking import OUTPUT_PATH as CANDIDATES_PATH
+from storage import read_table
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import tempfile
+import io
+import os
 from dotenv import dotenv_values
 
 PORT = "443"
+INNER_HITS_SIZE = 10 # References returned per assignee for the "Aggregation Source" fields
+PIT_KEEP_ALIVE = "2m" # How long a point in time is kept open between two pages of an exhaustive search
 DF_COLS = {
     "none": [],
     "elastic": {
@@ -36,20 +47,36 @@ DF_COLS = {
 
 
 #Processing methods
-def establish_connection():
+@st.cache_resource
+def establish_connection(timeout):
     config = dotenv_values(".env")
     es = Elasticsearch(hosts=f"{config['es_host']}:{PORT}", api_key=config['es_api_key'], request_timeout=timeout)
     # es = ElasticSearch(config['es_host'], api_key=config['es_api_key'])
     return es
 
+@st.cache_resource
+def candidate_index():
+    # Local search index built from the Parquet snapshot (see snapshot.py), shared by every session
+    return CandidateIndex.from_snapshot(SNAPSHOT_DIR)
+
+@st.cache_data
+def precomputed_candidates(path, mtime):
+    # Ranked candidates of every sampled mention written by blocking.py, reloaded whenever the file changes
+    return read_table(path).set_index("mention_id")
+
+@st.cache_resource
+def sql_engine():
+    # Pooled engine shared by every session and rerun, also used internally by extraction.py
+    return get_engine()
+
 def parse_csv(csv):
-    return [x.strip() for x in csv.split(",")]
+    return [x.strip() for x in csv.split(",") if len(x.strip()) > 0]
 
 def parse_results(results):
-    df = pd.DataFrame(results)
-    df['assignee_type'] = df['assignee_type'].apply(lambda x: convert_assignee_type(x))
-    df = df[['assignee_organization', 'assignee_id', 'assignee_individual_name_first', 'assignee_individual_name_last',\
-            'assignee_type', 'assignee_city', 'assignee_state', 'assignee_country', 'assignee_reference_id']]
+    df = normalize_columns(pd.DataFrame(results))
+    extra_cols = [col for col in df.columns if col not in DF_COLS["elastic"]] # Collapse counts and aggregation sources
+    df = df.reindex(columns=['assignee_organization', 'assignee_id', 'assignee_individual_name_first', 'assignee_individual_name_last',\
+            'assignee_type', 'assignee_city', 'assignee_state', 'assignee_country', 'assignee_reference_id'] + extra_cols)
     return df
 
 def _create_nested_query(field, full_field_path, query):
@@ -84,17 +111,156 @@ def process_query(user_query, fields, fuzziness=2):
 
     return {"bool": {"should": must_clauses}}
 
-@st.cache_data
-def search(user_query, index, fields, agg_fields, source, agg_source, timeout, size, fuzziness):
+def collapse_row(hit, agg_source):
+    """
+    Flatten one collapsed hit into a single row: the top reference of the assignee, the number of its matching
+    references, and the distinct values of each aggregation source field among its top references.
+    """
+    row = dict(hit["_source"])
+    references = hit["inner_hits"]["references"]["hits"]
+    row["reference_count"] = references["total"]["value"]
+    for field in agg_source:
+        values = [reference["_source"].get(field) for reference in references["hits"]]
+        row[field + "_values"] = "; ".join(dict.fromkeys(str(value) for value in values if value is not None))
+    return row
+
+def execute_search(user_query, index, fields, agg_fields, source, agg_source, timeout, size, fuzziness, backend="Elasticsearch"):
+    """
+    Search the index for `user_query`.
+
+    Args:
+        agg_fields: Fields to aggregate on. The first one (such as `assignee_id`) collapses the results to one row per
+            value, holding its best matching reference, so `size` counts distinct assignees instead of references.
+            Leave empty to get raw references.
+        source: Fields returned for each row (all fields used by the app by default). IDs are always returned.
+        agg_source: Fields returned for the top references of each collapsed row.
+        backend: "Elasticsearch", or "Local" to search the snapshot with candidates.CandidateIndex (only `fields`,
+            `size` and the collapse on assignee ID apply).
+    Returns:
+        A list of dictionaries, one per row.
+    """
+    if backend == "Local":
+        return candidate_index().search(user_query, fields[0], size, collapse=len(agg_fields) > 0)
     s = Search(using=es, index=index)
     search_dict = {
-        "aggregations": agg_fields,
         "size": size,
         "query": process_query(user_query, fields, fuzziness),
+        "_source": list(dict.fromkeys(source + ['assignee_id', 'assignee_reference_id'])) if source else list(DF_COLS["elastic"].keys()),
+        "timeout": f"{timeout}s",
     }
+    if len(agg_fields) > 0:
+        search_dict["collapse"] = {
+            "field": agg_fields[0],
+            "inner_hits": {"name": "references", "size": INNER_HITS_SIZE if len(agg_source) > 0 else 0,
+                           "_source": agg_source or False},
+        }
+        search_dict["track_total_hits"] = False
     s.update_from_dict(search_dict)
-    response = s.execute()
-    return [hit.to_dict() for hit in response]
+    response = s.execute().to_dict()
+    if len(agg_fields) > 0:
+        return [collapse_row(hit, agg_source) for hit in response["hits"]["hits"]]
+    return [hit["_source"] for hit in response["hits"]["hits"]]
+
+@st.cache_data
+def search(user_query, index, fields, agg_fields, source, agg_source, timeout, size, fuzziness, backend):
+    return execute_search(user_query, index, fields, agg_fields, source, agg_source, timeout, size, fuzziness, backend)
+
+@st.cache_data
+def variant_search(queries, index, agg_fields, source, agg_source, timeout, size, backend):
+    """
+    Run several searches concurrently and merge their results.
+
+    Args:
+        queries: List of (query string, fields, fuzziness) triples, such as the name variants of the seed mention.
+    Returns:
+        A list of dictionaries without repeated references (or assignees, when collapsing), in the order of `queries`,
+        each with the `variant` that found it first.
+    """
+    def run_query(query):
+        return execute_search(query[0], index, query[1], agg_fields, source, agg_source, timeout, size, query[2], backend)
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        results = list(executor.map(run_query, queries))
+
+    key = agg_fields[0] if len(agg_fields) > 0 else 'assignee_reference_id'
+    merged = {}
+    for (variant, variant_fields, variant_fuzziness), rows in zip(queries, results):
+        for row in rows:
+            merged.setdefault(row.get(key), {**row, "variant": variant})
+    return list(merged.values())
+
+def search_pages(user_query, index, fields, source, timeout, page_size, fuzziness):
+    """
+    Page through every reference matching `user_query` with a point in time and search_after, so results are
+    consistent across pages and not capped at 10,000.
+
+    Yields:
+        The list of references (`_source` dictionaries) of each page, best matches first.
+    """
+    pit_id = es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+    search_after = None
+    try:
+        while True:
+            s = Search(using=es)
+            search_dict = {
+                "size": page_size,
+                "query": process_query(user_query, fields, fuzziness),
+                "_source": list(dict.fromkeys(source + ['assignee_id', 'assignee_reference_id'])) if source else list(DF_COLS["elastic"].keys()),
+                "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+                "sort": [{"_score": "desc"}, {"_shard_doc": "asc"}],
+                "track_total_hits": False,
+                "timeout": f"{timeout}s",
+            }
+            if search_after is not None:
+                search_dict["search_after"] = search_after
+            s.update_from_dict(search_dict)
+            response = s.execute().to_dict()
+            hits = response["hits"]["hits"]
+            if len(hits) == 0:
+                break
+            yield [hit["_source"] for hit in hits]
+
+            # Continue after the last hit, with the point in time it refreshed
+            search_after = hits[-1]["sort"]
+            pit_id = response.get("pit_id", pit_id)
+            if len(hits) < page_size:
+                break
+    finally:
+        es.close_point_in_time(id=pit_id)
+
+def exhaustive_search(user_query, index, fields, source, timeout, page_size, fuzziness, max_assignees, placeholder):
+    """
+    Retrieve references page by page until every match is seen or `max_assignees` distinct assignee IDs are found,
+    showing the rows found so far in `placeholder` after each page. Results are kept in the session state so that
+    reruns do not page through the index again.
+
+    Returns:
+        A list of dictionaries, one per assignee ID: its best matching reference and its number of matching references.
+    """
+    key = (user_query, index, tuple(fields), tuple(source), page_size, fuzziness, max_assignees)
+    if st.session_state.get("exhaustive_search_key") == key:
+        return st.session_state.exhaustive_search_results
+
+    rows = {}
+    reference_count = 0
+    for page in search_pages(user_query, index, fields, source, timeout, page_size, fuzziness):
+        for reference in page:
+            assignee_id = reference.get("assignee_id")
+            if assignee_id in rows:
+                rows[assignee_id]["reference_count"] += 1
+            elif len(rows) < max_assignees:
+                rows[assignee_id] = {**reference, "reference_count": 1}
+        reference_count += len(page)
+        with placeholder.container():
+            st.caption(f"Searching... {len(rows)} assignees found in {reference_count} references")
+            st.dataframe(parse_results(list(rows.values())), hide_index=True)
+        if len(rows) >= max_assignees:
+            break
+    placeholder.empty()
+
+    st.session_state.exhaustive_search_key = key
+    st.session_state.exhaustive_search_results = list(rows.values())
+    return st.session_state.exhaustive_search_results
 
 with st.sidebar:
 
@@ -112,15 +278,28 @@ with st.sidebar:
     with st.expander("Configuration", expanded=True):
         timeout = st.number_input("Timeout", value=30, help="Search timeout in seconds.")
         index = st.text_input("Index", value="assignee_references", help="Index to search in.")
+        backend = st.radio("Backend", ["Elasticsearch", "Local"], horizontal=True, help="Local searches the Parquet "
+            "snapshot on this machine (run `python snapshot.py` first) and works without Elasticsearch.")
         fuzziness = st.number_input("Fuzziness", value=2, help="Fuzziness level for matching.", min_value=0, max_value=2)
         size = st.number_input("Size", value=50, help="Number of search results to display.", min_value=5, max_value=10000)
+        exhaustive = st.checkbox("Exhaustive", value=False, disabled=backend != "Elasticsearch", help="Page through "
+            "every matching reference instead of a single request of `Size` results, `Size` being the page size. "
+            "Requires the Elasticsearch backend: Local searches return at most `Size` results.")
+        max_assignees = st.number_input("Max Assignees", value=1000, min_value=1, disabled=backend != "Elasticsearch",
+            help="Exhaustive searches stop once this many distinct assignee IDs are found.")
         col_select_placeholder = st.empty()
 
     with st.expander("Search Fields (comma separated):", expanded=False):
         source = parse_csv(st.text_input("Source", value="", help="Fields to return in the response.", )) # list(DF_COLS["elastic"].keys()) 
-        agg_fields = parse_csv(st.text_input("Aggregation Fields", value="", help="Fields to aggregate on."))
+        agg_fields = parse_csv(st.text_input("Aggregation Fields", value="assignee_id", help="Fields to aggregate on. "
+            "Results are collapsed to one row per value of the first field, leave empty to list every reference."))
         agg_source = parse_csv(st.text_input("Aggregation Source", value="", help="Fields to return for each top hit in the aggregations."))
 
+    with st.expander("Query Metrics", expanded=False):
+        st.dataframe(query_metrics().sort_values("timestamp", ascending=False), hide_index=True)
+
+sql_engine()
+
 """
 Mention ID:
 """
@@ -151,6 +330,13 @@ else:
     gp_url = "https://patents.google.com/"
     assignee_mention_data = None
 
+# Candidates precomputed for the sampled mentions (python blocking.py), shown until the search is edited
+mention_candidates = None
+if len(mention_id) > 0 and os.path.exists(CANDIDATES_PATH):
+    candidates = precomputed_candidates(CANDIDATES_PATH, os.path.getmtime(CANDIDATES_PATH))
+    if mention_id in candidates.index:
+        mention_candidates = candidates.loc[[mention_id]]
+
 # Create links to PV and Google Patents
 col2.link_button(label="PatentsView", url=pv_url)
 col3.link_button(label="Google Patents", url=gp_url)
@@ -159,18 +345,41 @@ col3.link_button(label="Google Patents", url=gp_url)
 """
 Search:
 """
-es = establish_connection()
+es = establish_connection(timeout) if backend == "Elasticsearch" else None
 user_query_null = "" if assignee_mention_data is None else assignee_mention_data['value'][9]
 user_query = st.text_input(label="Search", value=user_query_null, label_visibility="collapsed")
 field_options = ["Organization", "First Name", "Last Name"]
-field_select = st.radio("Fields:", field_options, horizontal=True, label_visibility="collapsed")
+col1, col2 = st.columns([4, 1])
+field_select = col1.radio("Fields:", field_options, horizontal=True, label_visibility="collapsed")
+expand_variants = col2.checkbox("Name variants", value=False, help="Also search the name without corporate suffixes, "
+    "accents or punctuation, its acronym, and for individuals the reordered name in both name fields.")
 fields = [list(DF_COLS["elastic"].keys())[field_options.index(field_select)]]
 
+# Name variants, searched concurrently (individual names are also searched in the other name field)
+variant_queries = []
+if expand_variants and len(user_query) > 0:
+    individual = field_select != "Organization"
+    name_fields = [fields[0]] + ([col for col in list(DF_COLS["elastic"].keys())[1:3] if col != fields[0]] if individual else [])
+    acronym = None if individual else name_acronym(user_query) # Searched exactly, fuzzy acronyms match anything short
+    variant_queries = [(variant, [field], 0 if variant == acronym else fuzziness)
+                       for variant in name_variants(user_query, individual) for field in name_fields]
+
 # Execute search
 if len(user_query) > 0:
     try:
-        results = search(user_query=user_query, index=index, fields=fields, agg_fields=[],\
-                        source=[], agg_source=[], timeout=timeout, size=size, fuzziness=fuzziness)
+        if mention_candidates is not None and user_query == user_query_null and len(variant_queries) == 0:
+            st.caption(f"{len(mention_candidates.index)} precomputed candidates from `{CANDIDATES_PATH}`. Edit the "
+                       f"search to query {backend} instead.")
+            results = mention_candidates.to_dict(orient="records")
+        elif exhaustive and backend == "Elasticsearch":
+            results = exhaustive_search(user_query=user_query, index=index, fields=fields, source=source, timeout=timeout,\
+                                        page_size=size, fuzziness=fuzziness, max_assignees=max_assignees, placeholder=st.empty())
+        elif len(variant_queries) > 0:
+            results = variant_search(queries=variant_queries, index=index, agg_fields=agg_fields, source=source,\
+                                     agg_source=agg_source, timeout=timeout, size=size, backend=backend)
+        else:
+            results = search(user_query=user_query, index=index, fields=fields, agg_fields=agg_fields,\
+                            source=source, agg_source=agg_source, timeout=timeout, size=size, fuzziness=fuzziness, backend=backend)
     except Exception as e:
         st.error("Could not complete the search!", icon="🚨")
         st.error(e)
@@ -246,21 +455,18 @@ if len(user_query) > 0:
     filename_value = (mention_id+".csv") if len(mention_id) > 0 else ""
     filename = col1.text_input(label="Filename", placeholder="Filename", value=filename_value, label_visibility="collapsed")
 
-    # Create the bytes data file necessary for downloading output
+    # Create the bytes data necessary for downloading output, streamed straight into memory
+    # Complex extractions (with inventors and CPC subclasses) come from the PV API
     def extract_output(simplified, filename):
+        buffer = io.BytesIO()
+        extract = run_extraction if simplified else run_complex_extraction
         if filename[-4:]==".csv":
-            with tempfile.NamedTemporaryFile(suffix=".csv") as temp:
-                run_extraction(assignee_IDs=list(st.session_state.selected_assignee_ids), output_path=temp.name, simplified=simplified)
-                with open(temp.name, "rb") as file:
-                    bytes_data = file.read()
+            extract(assignee_IDs=list(st.session_state.selected_assignee_ids), output_path=buffer, simplified=simplified, file_format="csv")
             mime="text/csv"
         elif filename[-5:]==".xlsx":
-            with tempfile.NamedTemporaryFile(suffix=".xlsx") as temp:
-                run_extraction(assignee_IDs=list(st.session_state.selected_assignee_ids), output_path=temp.name, simplified=simplified)
-                with open(temp.name, "rb") as file:
-                    bytes_data = file.read()
+            extract(assignee_IDs=list(st.session_state.selected_assignee_ids), output_path=buffer, simplified=simplified, file_format="xlsx")
             mime="application/vnd.ms-excel"
-        return bytes_data, mime
+        return buffer.getvalue(), mime
 
     # Download regular output
     if col2.button("Extract simplified"):
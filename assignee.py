@@ -1,25 +1,32 @@
-from sqlalchemy import create_engine, text
-from dotenv import dotenv_values
+from sqlalchemy import text
+from connection import get_engine
+from storage import read_table, write_table, table_format
 import pandas as pd
 import numpy as np
 import os
 
+PATENT_ONLY_FIELDS = ("patent_id, assignee_sequence, organization, name_first, name_last, assignee_type, title, "
+                      "patent_date, assignee_country, assignee_city, assignee_state")
+JOURNAL_MANIFEST = "manifest.tsv"
+
 
 """
-Establish MySQL connection with environmental variables
+Establish MySQL connection with environmental variables, shared with extraction.py through connection.get_engine()
 
 Returns
 -------
 engine : a PyMySQL engine object
 """
 def establish_connection():
-    config = dotenv_values(".env")
-    user = config['user']
-    pswd = config['password']
-    hostname = config['hostname']
-    dbname = config['dbname']
-    engine = create_engine(f"mysql+pymysql://{user}:{pswd}@{hostname}/{dbname}?charset=utf8mb4")
-    return engine
+    return get_engine()
+
+
+"""
+Split a mention ID of the form US<patent_id>-<sequence_number> into its (patent_id, assignee_sequence) strings
+"""
+def split_mention_id(mention_id: str):
+    split = mention_id.split("-")
+    return split[0][2:], split[1]
 
 
 """
@@ -49,19 +56,13 @@ Pandas Dataframe, with columns for (the non-disambiguated version of):
 """
 def assignee_data(mention_id: str, patent_only: bool, connection):
     # Getting patent information
-    split = mention_id.split("-")
-    patent_id = split[0][2:]
-    sequence = split[1]
+    patent_id, sequence = split_mention_id(mention_id)
 
     # Running query on algorithms_assignee_labeling view
-    if patent_only:
-        query = f"SELECT patent_id, assignee_sequence, organization, name_first, name_last, assignee_type, title, patent_date,\
-            assignee_country, assignee_city, assignee_state FROM algorithms_assignee_labeling.assignee WHERE\
-            patent_id='{patent_id}' and assignee_sequence='{sequence}'"
-    else:
-        query = (f"SELECT * FROM algorithms_assignee_labeling.assignee WHERE patent_id='{patent_id}' and "
-                 f"assignee_sequence='{sequence}'")
-    result = connection.execute(text(query)).fetchall()
+    fields = PATENT_ONLY_FIELDS if patent_only else "*"
+    query = (f"SELECT {fields} FROM algorithms_assignee_labeling.assignee WHERE patent_id=:patent_id and "
+             f"assignee_sequence=:sequence")
+    result = connection.execute(text(query), {"patent_id": patent_id, "sequence": sequence}).fetchall()
 
     # Return pandas df
     df = pd.DataFrame(result).drop_duplicates()
@@ -71,32 +72,356 @@ def assignee_data(mention_id: str, patent_only: bool, connection):
 """
 Parameters
 ----------
-size : int
-    Number of samples
+mention_ids : list of str
+    Mention IDs of the form US<patent_id>-<sequence_number>
+patent_only : Boolean
+    Same as in assignee_data()
+connection : sqlalchemy.engine.base.Connection
+    Connection using sqlalchemy to the PV database.
+
+Returns
+-------
+Pandas Dataframe with the same columns as assignee_data(), containing the rows for every mention ID in
+`mention_ids`. All mentions are fetched with a single query on (patent_id, assignee_sequence) pairs.
+"""
+def assignee_data_batch(mention_ids, patent_only: bool, connection):
+    # Build one bound (patent_id, assignee_sequence) pair per mention
+    params = {}
+    pairs = []
+    for i, mention_id in enumerate(mention_ids):
+        params[f"p{i}"], params[f"s{i}"] = split_mention_id(mention_id)
+        pairs.append(f"(:p{i}, :s{i})")
+    if len(pairs) == 0:
+        return pd.DataFrame()
+
+    # Running query on algorithms_assignee_labeling view
+    fields = PATENT_ONLY_FIELDS if patent_only else "*"
+    query = (f"SELECT {fields} FROM algorithms_assignee_labeling.assignee "
+             f"WHERE (patent_id, assignee_sequence) IN ({', '.join(pairs)})")
+    result = connection.execute(text(query), params).fetchall()
+
+    # Return pandas df
+    df = pd.DataFrame(result).drop_duplicates()
+    return df
+
 
-Pulls a random sample of assignee mention_id's from AWS and saves it as an output CSV file
 """
-def sample_mentions(size=800, output_dir="data/", seed=20231025):
-    # Load in data
-    disamb = pd.read_csv(
-        "g_persistent_assignee.tsv.zip",
-        dtype=str,
-        sep="\t",
-        compression="zip")
+Parameters
+----------
+input_path : str
+    Path to the PatentsView g_persistent_assignee.tsv.zip bulk download file
+columns : list of str
+    Columns to read, typically `patent_id`, `assignee_sequence` and the chosen `disamb_assignee_id_*` columns
+chunksize : int
+    Number of rows per chunk
 
-    # Clean data
-    disamb["mention_id"] = "US" + disamb["patent_id"] + "-" + disamb["assignee_sequence"]
-    disamb_20230629 = disamb[["mention_id", "disamb_assignee_id_20230629"]]
-    disamb_20230629 = disamb_20230629.dropna()
+Returns
+-------
+Iterator over Pandas Dataframes of at most `chunksize` rows, so the bulk file never has to fit in memory
+"""
+def read_persistent_assignee(input_path="g_persistent_assignee.tsv.zip", columns=None, chunksize=1_000_000):
+    return pd.read_csv(input_path, dtype=str, sep="\t", compression="zip", usecols=columns, chunksize=chunksize)
 
-    # Sample and extract cluster sizes
-    sampled_df = disamb_20230629.sample(n=size, random_state=seed)
-    cluster_size_lookup = disamb_20230629["disamb_assignee_id_20230629"].value_counts()
-    sampled_df["cluster_size"] = [cluster_size_lookup[disamb_id] for disamb_id in sampled_df["disamb_assignee_id_20230629"]]
+
+"""
+Parameters
+----------
+size : int
+    Number of samples
+disamb_columns : str or list of str
+    Disambiguation snapshot columns of g_persistent_assignee, such as "disamb_assignee_id_20230629". Mentions are
+    sampled from the first column and cluster sizes are computed for every column.
+chunksize : int or None
+    If set, stream the bulk file `chunksize` rows at a time and draw a reservoir sample, keeping memory usage flat
+    regardless of the file size. Otherwise, load the needed columns in memory.
+strata : list of int or None
+    If set, cluster size bucket edges for stratified sampling on the first column, such as [1, 2, 10, 100, 1000].
+    Bucket i holds mentions whose cluster size is at least strata[i] and less than strata[i + 1], the last bucket is
+    open-ended, and the sample is split evenly across buckets. If strata[0] > 1, smaller clusters form bucket -1.
+
+Pulls a random sample of assignee mention_id's from AWS and saves it as an output CSV file with columns:
+    - mention_id
+    - cluster_size, the cluster size in the first snapshot column
+    - cluster_size_<snapshot> for every other snapshot column
+    - cluster_size_bucket, when sampling is stratified
+    - sample_weight, the inverse of the probability that the mention was sampled
+"""
+def sample_mentions(size=800, output_dir="data/", seed=20231025, disamb_columns="disamb_assignee_id_20230629",
+                    chunksize=None, input_path="g_persistent_assignee.tsv.zip", strata=None):
+    disamb_columns = [disamb_columns] if isinstance(disamb_columns, str) else list(disamb_columns)
+    size_columns = [cluster_size_column(column, disamb_columns) for column in disamb_columns]
+    if chunksize is not None:
+        sampled_df = sample_mentions_streaming(size, seed, disamb_columns, chunksize, input_path, strata)
+    else:
+        # Load in data
+        columns = ["patent_id", "assignee_sequence"] + disamb_columns
+        disamb = pd.read_csv(input_path, dtype=str, sep="\t", compression="zip", usecols=columns)
+
+        # Extract cluster sizes of every snapshot, then keep mentions disambiguated in the first one
+        for column, size_column in zip(disamb_columns, size_columns):
+            disamb[size_column] = cluster_sizes(disamb[column])
+        disamb = disamb.dropna(subset=[disamb_columns[0]])
+
+        # Sample, either uniformly or evenly across cluster size buckets
+        if strata is None:
+            sampled_df = disamb.sample(n=size, random_state=seed)
+            sampled_df["sample_weight"] = len(disamb.index) / size
+        else:
+            disamb["bucket"] = cluster_size_bucket(disamb["cluster_size"], strata)
+            bucket_counts = disamb["bucket"].value_counts()
+            allocation = stratum_allocation(bucket_counts, size)
+            sampled_df = pd.concat([disamb[disamb["bucket"] == bucket].sample(n=n, random_state=seed)
+                                    for bucket, n in allocation.items() if n > 0])
+            sampled_df["sample_weight"] = sampled_df["bucket"].map(bucket_counts / pd.Series(allocation))
+        sampled_df["mention_id"] = "US" + sampled_df["patent_id"] + "-" + sampled_df["assignee_sequence"]
 
     # Save output
+    output_columns = ["mention_id"] + size_columns
+    if strata is not None:
+        sampled_df["cluster_size_bucket"] = sampled_df["bucket"].map(bucket_labels(strata))
+        output_columns.append("cluster_size_bucket")
     np.savetxt(os.path.join(output_dir, "01 - sample.txt"), sampled_df["mention_id"].values, fmt="%s")
-    sampled_df[["mention_id", "cluster_size"]].to_csv(os.path.join(output_dir, "01 - sample_with_cluster_size.csv"), index=False)
+    sampled_df[output_columns + ["sample_weight"]].to_csv(os.path.join(output_dir, "01 - sample_with_cluster_size.csv"), index=False)
+
+
+"""
+Name of the cluster size column for a disambiguation snapshot column, "cluster_size" for the sampled (first) snapshot
+and "cluster_size_<snapshot>" otherwise
+"""
+def cluster_size_column(disamb_column, disamb_columns):
+    if disamb_column == disamb_columns[0]:
+        return "cluster_size"
+    return "cluster_size_" + disamb_column.replace("disamb_assignee_id_", "")
+
+
+"""
+Parameters
+----------
+disamb_ids : Pandas Series
+    Disambiguated assignee IDs, possibly with missing values
+
+Returns
+-------
+Pandas Series with the size of each row's cluster (<NA> for missing IDs), computed with categorical codes and a
+single bincount
+"""
+def cluster_sizes(disamb_ids):
+    codes, uniques = pd.factorize(disamb_ids)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    sizes = pd.array(counts[codes], dtype="Int64")
+    sizes[codes < 0] = pd.NA
+    return pd.Series(sizes, index=disamb_ids.index)
+
+
+"""
+Index of the cluster size bucket for each value of `cluster_size`, following the bucket edges in `strata`. Sizes below
+strata[0] are in bucket -1.
+"""
+def cluster_size_bucket(cluster_size, strata):
+    return pd.Series(np.searchsorted(strata, cluster_size.to_numpy(dtype="int64"), side="right") - 1,
+                     index=cluster_size.index)
+
+
+"""
+Dictionary of readable labels for the cluster size buckets defined by the edges in `strata`, by bucket index, such as
+"2-9" or "1000+", and "<2" for bucket -1 if strata[0] is 2
+"""
+def bucket_labels(strata):
+    labels = [f"{low}-{high - 1}" if high - 1 > low else str(low) for low, high in zip(strata[:-1], strata[1:])] \
+        + [f"{strata[-1]}+"]
+    below = {-1: f"<{strata[0]}"} if strata[0] > 1 else {}
+    return {**below, **dict(enumerate(labels))}
+
+
+"""
+Parameters
+----------
+bucket_counts : Pandas Series
+    Number of mentions in each cluster size bucket
+size : int
+    Total number of samples
+
+Returns
+-------
+Dictionary with the number of samples to draw from each bucket. Samples are split evenly, and the share of buckets
+with too few mentions is redistributed to the remaining buckets.
+"""
+def stratum_allocation(bucket_counts, size):
+    allocation = {}
+    remaining = size
+    buckets = bucket_counts[bucket_counts > 0].sort_values().index.tolist()
+    for i, bucket in enumerate(buckets):
+        allocation[bucket] = min(int(bucket_counts[bucket]), remaining // (len(buckets) - i))
+        remaining -= allocation[bucket]
+    return allocation
+
+
+"""
+Parameters
+----------
+input_path : str
+    Path to the PatentsView g_persistent_assignee.tsv.zip bulk download file
+disamb_columns : list of str
+    Disambiguation snapshot columns
+chunksize : int
+    Number of rows per chunk
+
+Returns
+-------
+Dictionary from each column of `disamb_columns` to a Pandas Series of cluster sizes indexed by disambiguated assignee
+ID, counted in a single streaming pass over the bulk file
+"""
+def count_cluster_sizes(input_path, disamb_columns, chunksize=1_000_000):
+    counts = {column: pd.Series(dtype="int64") for column in disamb_columns}
+    for chunk in read_persistent_assignee(input_path, disamb_columns, chunksize):
+        for column in disamb_columns:
+            counts[column] = counts[column].add(chunk[column].value_counts(), fill_value=0)
+    return {column: count.astype("int64") for column, count in counts.items()}
+
+
+"""
+Streaming version of the sampling step in sample_mentions(). Every row with a non-empty first snapshot column gets a
+uniform random key drawn from a generator seeded with `seed`, and the rows with the smallest keys in each bucket are
+kept (a reservoir sample, equivalent to sampling without replacement). Without strata there is a single bucket and
+cluster sizes are counted chunk by chunk in the same pass. With strata, a first pass counts cluster sizes so that
+each row can be assigned to its bucket. Only the reservoir and one count per cluster are held in memory.
+
+Returns
+-------
+Pandas Dataframe with `mention_id`, `bucket`, `sample_weight` and cluster size columns for the sampled mentions
+"""
+def sample_mentions_streaming(size, seed, disamb_columns, chunksize, input_path="g_persistent_assignee.tsv.zip",
+                              strata=None):
+    rng = np.random.default_rng(seed)
+    columns = ["patent_id", "assignee_sequence"] + disamb_columns
+    reservoir = pd.DataFrame({column: pd.Series(dtype=str) for column in columns})\
+        .assign(bucket=pd.Series(dtype="int64"), key=pd.Series(dtype=float))
+
+    # Stratification needs cluster sizes, and so bucket sizes, before sampling
+    if strata is not None:
+        counts = count_cluster_sizes(input_path, disamb_columns, chunksize)
+        cluster_buckets = cluster_size_bucket(counts[disamb_columns[0]], strata)
+        bucket_counts = counts[disamb_columns[0]].groupby(cluster_buckets).sum()
+        allocation = stratum_allocation(bucket_counts, size)
+    else:
+        counts = {column: pd.Series(dtype="int64") for column in disamb_columns}
+        allocation = {0: size}
+
+    for chunk in read_persistent_assignee(input_path, columns, chunksize):
+        if strata is None:
+            for column in disamb_columns:
+                counts[column] = counts[column].add(chunk[column].value_counts(), fill_value=0)
+        chunk = chunk.dropna(subset=[disamb_columns[0]])
+        chunk["bucket"] = 0 if strata is None else chunk[disamb_columns[0]].map(cluster_buckets)
+
+        # Keep the rows with the smallest random keys seen so far in each bucket
+        chunk["key"] = rng.random(len(chunk.index))
+        reservoir = pd.concat([reservoir, chunk], ignore_index=True)
+        rank = reservoir.groupby("bucket")["key"].rank(method="first")
+        reservoir = reservoir[rank <= reservoir["bucket"].map(allocation).fillna(0)]
+
+    if strata is None:
+        bucket_counts = pd.Series({0: counts[disamb_columns[0]].sum()})
+
+    # Build mention IDs and cluster sizes for the sampled rows only
+    sampled_df = reservoir.sort_values(["bucket", "key"]).reset_index(drop=True)
+    sampled_df["mention_id"] = "US" + sampled_df["patent_id"] + "-" + sampled_df["assignee_sequence"]
+    for column in disamb_columns:
+        sampled_df[cluster_size_column(column, disamb_columns)] = sampled_df[column].map(counts[column]).astype("Int64")
+    sampled_df["sample_weight"] = sampled_df["bucket"].map(bucket_counts / pd.Series(allocation))
+    return sampled_df
+
+
+"""
+Parameters
+----------
+journal_dir : str
+    Folder holding the checkpoint journal of populate_sample()
+
+Returns
+-------
+Set of mention IDs recorded in the journal manifest as fully populated
+"""
+def journal_manifest(journal_dir):
+    manifest_path = os.path.join(journal_dir, JOURNAL_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return set()
+    with open(manifest_path, "r") as manifest:
+        lines = manifest.read().split("\n")[:-1] # Last line is either empty or torn by an interrupted write
+    return {line.split("\t")[0] for line in lines if "\t" in line}
+
+
+"""
+Parameters
+----------
+df : Pandas Dataframe
+    Populated rows for `mention_ids`, as returned by assignee_data_batch()
+mention_ids : list of str
+    Mention IDs covered by `df`, including those which returned no rows
+journal_dir : str
+    Folder holding the checkpoint journal of populate_sample()
+
+Output
+------
+Writes `df` as a new part file in `journal_dir`, then appends `mention_ids` to the journal manifest. A part is only
+referenced by the manifest once it is completely written, so an interrupted run never corrupts previous batches.
+"""
+def append_to_journal(df, mention_ids, journal_dir):
+    if not os.path.exists(journal_dir):
+        os.makedirs(journal_dir)
+
+    # Write the part file to a temporary path and atomically move it in place (batches without rows have no part)
+    part_name = ""
+    if len(df.index) > 0:
+        part_numbers = [int(os.path.splitext(file)[0][5:]) for file in os.listdir(journal_dir)
+                        if file.startswith("part-") and file.endswith((".csv", ".parquet"))]
+        part_name = "part-%05d.parquet" % (max(part_numbers, default=-1) + 1)
+        temp_path = os.path.join(journal_dir, part_name + ".tmp")
+        with open(temp_path, "wb") as part:
+            write_table(df, part, index=False, file_format="parquet")
+            part.flush()
+            os.fsync(part.fileno())
+        os.replace(temp_path, os.path.join(journal_dir, part_name))
+
+    # Record completed mention IDs, starting a fresh line if the previous append was interrupted
+    manifest_path = os.path.join(journal_dir, JOURNAL_MANIFEST)
+    with open(manifest_path, "a+") as manifest:
+        manifest.seek(0, os.SEEK_END)
+        if manifest.tell() > 0:
+            manifest.seek(manifest.tell() - 1)
+            if manifest.read(1) != "\n":
+                manifest.write("\n")
+        manifest.write("".join(f"{mention_id}\t{part_name}\n" for mention_id in mention_ids))
+        manifest.flush()
+        os.fsync(manifest.fileno())
+
+
+"""
+Parameters
+----------
+journal_dir : str
+    Folder holding the checkpoint journal of populate_sample()
+output_path : str
+    Path to Parquet (or CSV) file for saving the compacted data, in the format expected by segment_sample()
+
+Output
+------
+Concatenates every part file referenced by the journal manifest and atomically replaces `output_path`. An empty
+dataframe is written when the journal has no rows (empty sample, or no batch returned data).
+"""
+def compact_journal(journal_dir, output_path="data/02 - sample_with_data.parquet"):
+    manifest_path = os.path.join(journal_dir, JOURNAL_MANIFEST)
+    lines = []
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as manifest:
+            lines = manifest.read().split("\n")[:-1]
+    part_names = sorted({line.split("\t")[1] for line in lines if "\t" in line} - {""})
+
+    # Parts from a batch that was re-run after an interruption can overlap, so drop repeated rows
+    df_list = [read_table(os.path.join(journal_dir, part_name)) for part_name in part_names]
+    df = pd.concat(df_list, axis=0, ignore_index=True).drop_duplicates(ignore_index=True) if df_list else pd.DataFrame()
+    write_table(df, output_path + ".tmp", file_format=table_format(output_path))
+    os.replace(output_path + ".tmp", output_path)
 
 
 """
@@ -107,57 +432,62 @@ connection : sqlalchemy.engine.base.Connection
 sample_path : str
     Path to CSV file containing a list of mention IDs (`mention_id` field values)
 output_path : str
-    Path to CSV file for saving populated data. This method both reads and writes for intermitent progress
+    Path to Parquet (or CSV) file for saving populated data
+batch_size : int
+    Number of mention IDs fetched per query
+journal_dir : str
+    Folder for the append-only checkpoint journal. Defaults to `output_path` with a " - journal" suffix.
 
 Output
 ------
 Saves data to `output_path` which is a dataframe with one row for every element in `sample`
 Each row has all the attributes in assignee_data()
+Each completed batch is appended to `journal_dir`, which is used to resume an interrupted run.
 """
-def populate_sample(connection, sample_path="data/01 - sample.txt", output_path="data/02 - sample_with_data.csv"):
-    # Load sample data and determine which are previously populated
-    sample = np.loadtxt(sample_path, dtype=str)
-    prev_df = pd.read_csv(output_path) if os.path.exists(output_path) else pd.DataFrame()
-    df_list = [prev_df]
-    populated = ["US" + str(row.patent_id) + "-" + str(row.assignee_sequence) for index, row in prev_df.iterrows()]
+def populate_sample(connection, sample_path="data/01 - sample.txt", output_path="data/02 - sample_with_data.parquet",
+                    batch_size=500, journal_dir=None):
+    journal_dir = journal_dir or os.path.splitext(output_path)[0] + " - journal"
 
-    for mention_id in sample:
-        if mention_id in populated:
-            continue
+    # Seed the journal with data populated before journaling existed
+    if not os.path.exists(journal_dir) and os.path.exists(output_path):
+        prev_df = read_table(output_path, index_col=0)
+        prev_ids = ("US" + prev_df["patent_id"] + "-" + prev_df["assignee_sequence"].astype(str)).unique()
+        append_to_journal(prev_df, prev_ids, journal_dir)
 
-        # Populate mention_id and save data
-        temp_df = assignee_data(mention_id, True, connection)
-        df_list.append(temp_df)
-        populated.append(mention_id)
+    # Load sample data and determine which are previously populated
+    sample = np.loadtxt(sample_path, dtype=str, ndmin=1)
+    populated = journal_manifest(journal_dir)
+    todo = [mention_id for mention_id in sample if mention_id not in populated]
 
-        # Output messages
-        percent = str(round(100 * len(populated) / len(sample), 1)) + "%"
-        print(percent, "- created row for", mention_id)
+    for start in range(0, len(todo), batch_size):
+        # Populate a batch of mention_ids and append it to the journal
+        batch = todo[start:start + batch_size]
+        append_to_journal(assignee_data_batch(batch, True, connection), batch, journal_dir)
 
-        # Store dataframe intermitently
-        if len(populated) % 20 == 0:
-            pd.concat(df_list, axis=0, ignore_index=True).to_csv(output_path)
+        # Output messages
+        percent = str(round(100 * (len(sample) - len(todo) + start + len(batch)) / len(sample), 1)) + "%"
+        print(percent, "- created rows for", len(batch), "mention IDs")
 
     # Save final dataframe
-    pd.concat(df_list, axis=0, ignore_index=True).to_csv(output_path)
+    compact_journal(journal_dir, output_path)
 
 
 """
 Parameters
 ----------
 n (int) : Number of hand labelers
-sample_path (str) : path to CSV file containing samples with data
+sample_path (str) : path to Parquet (or CSV) file containing samples with data
 output_path (str) : folder to save n different dataframes
 
 Output
 ------
 Folder with n different files, each an equally sized partition of sample_path
 """
-def segment_sample(n=3, sample_path="data/02 - sample_with_data.csv", output_folder="data/03 - segmented samples/"):
+def segment_sample(n=3, sample_path="data/02 - sample_with_data.parquet", output_folder="data/03 - segmented samples/"):
     # Load input data and create output folder
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
-    samples = pd.read_csv(sample_path, index_col=0)
+    samples = read_table(sample_path, index_col=0)
     sample_count = len(samples.index)
 
     # Values to increment
@@ -169,9 +499,9 @@ def segment_sample(n=3, sample_path="data/02 - sample_with_data.csv", output_fol
     for i in range(n):
         end = end if i in range(sample_count % n) else end - 1 # Handle uneven distribution
 
-        # Save each data partition
+        # Save each data partition, as CSV for the hand labelers
         output_path = os.path.join(output_folder, str(i) + " - hand_labeler_file.csv")
-        samples.loc[start:end].to_csv(output_path)
+        write_table(samples.loc[start:end], output_path)
 
         # Increment values for next iteration
         start = end + 1
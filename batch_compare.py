@@ -0,0 +1,109 @@
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from parallel import parallel_map
+from storage import write_table
+import compare
+import deduplicate
+import sys
+import os
+
+WORKERS = 8 # Threads reading files
+PARALLEL_MIN_JOBS = 16
+
+
+"""
+Parameters
+----------
+paths : list of str
+    Hand labeled files to load
+workers : int
+    Number of threads reading files
+
+Returns
+-------
+Dictionary from path to its content, every distinct file being read exactly once
+"""
+def load_files(paths, workers=WORKERS):
+    paths = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(compare.load_file, paths)))
+
+
+"""
+Writes the output of one comparison `job` of run_batch(): the two loaded files, their names, the comparison function
+and the output path
+"""
+def run_job(job):
+    file1, file2, name1, name2, function, output = job
+    write_table(function(file1, file2, name1, name2), output, index=False)
+    return output
+
+
+"""
+Parameters
+----------
+manifest : Pandas Dataframe
+    One row per comparison, with either `mention_id`, `labeler1` and `labeler2` columns (labeler comparisons saved
+    by compare.py in `07 - evaluation`, named after the labelers when a cluster has several pairs) or `mention_id_1` and `mention_id_2` columns (cluster deduplications saved by
+    deduplicate.py in `08 - deduplication`)
+input_dir, output_dir : str
+    Folders of the hand labeled files and of the outputs, default to the folders of compare.py or deduplicate.py
+workers : int
+    Number of threads reading files
+processes : int
+    Number of processes running comparisons, defaults to the number of CPUs
+
+Returns
+-------
+List of the output paths, in the order of `manifest`
+"""
+def run_batch(manifest, input_dir=None, output_dir=None, workers=WORKERS, processes=None):
+    if {"mention_id", "labeler1", "labeler2"}.issubset(manifest.columns):
+        input_dir = input_dir or compare.INPUT_DIR
+        output_dir = output_dir or compare.OUTPUT_DIR
+        # Clusters compared by several pairs of labelers get one output per pair
+        repeated = set(manifest["mention_id"][manifest["mention_id"].duplicated()])
+        jobs = [((compare.labeler_path(row.mention_id, row.labeler1, input_dir),
+                  compare.labeler_path(row.mention_id, row.labeler2, input_dir)),
+                 (row.labeler1, row.labeler2), compare.compare_files,
+                 compare.output_path(row.mention_id, output_dir, *((row.labeler1, row.labeler2) if row.mention_id in repeated else ())))
+                for row in manifest.itertuples(index=False)]
+    elif {"mention_id_1", "mention_id_2"}.issubset(manifest.columns):
+        input_dir = input_dir or deduplicate.INPUT_DIR
+        output_dir = output_dir or deduplicate.OUTPUT_DIR
+        jobs = [((deduplicate.cluster_path(row.mention_id_1, input_dir), deduplicate.cluster_path(row.mention_id_2, input_dir)),
+                 (row.mention_id_1, row.mention_id_2), deduplicate.deduplicate_files,
+                 deduplicate.output_path(row.mention_id_1, row.mention_id_2, output_dir))
+                for row in manifest.itertuples(index=False)]
+    else:
+        raise ValueError("Manifest needs mention_id, labeler1 and labeler2 columns or mention_id_1 and mention_id_2 columns")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Load every file once, even if it appears in several pairs
+    files = load_files([path for paths, names, function, output in jobs for path in paths], workers)
+    print("Done reading", len(files), "files.")
+
+    # Compare all pairs in worker processes, each job carrying only its two files
+    jobs = [(files[path1], files[path2], name1, name2, function, output)
+            for (path1, path2), (name1, name2), function, output in jobs]
+    outputs = list(parallel_map(run_job, jobs, PARALLEL_MIN_JOBS, processes))
+    print("Successfully saved", len(outputs), "output files.")
+    return outputs
+
+if __name__ == "__main__":
+    # Usage: python batch_compare.py [--input-dir <dir>] [--output-dir <dir>] <manifest.csv> [<manifest.csv> ...]
+    # Both folders default to those of compare.py or deduplicate.py
+    args = sys.argv[1:]
+    dirs = {}
+    while args and args[0] in ("--input-dir", "--output-dir"):
+        dirs[args[0][2:].replace("-", "_")] = args[1]
+        args = args[2:]
+
+    # Manifests of the same kind are run as one batch, so files listed in several manifests are read once
+    manifests = {}
+    for manifest_path in args:
+        manifest = pd.read_csv(manifest_path, dtype=str)
+        manifests.setdefault(tuple(sorted(manifest.columns)), []).append(manifest)
+    for kind in manifests.values():
+        run_batch(pd.concat(kind, ignore_index=True), **dirs)
\ No newline at end of file
@@ -0,0 +1,202 @@
+import pandas as pd
+from assignee import read_persistent_assignee, count_cluster_sizes, cluster_size_bucket, bucket_labels
+from safety_checks import validate_files, DIRECTORY_PATH
+import sys
+import os
+
+SAMPLE_PATH = "data/01 - sample_with_cluster_size.csv"
+OUTPUT_DIR = "data/09 - benchmark/"
+
+
+"""
+Parameters
+----------
+directory_path : str
+    Folder of hand labeled files, "<seed mention ID>.csv"
+
+Returns
+-------
+Pandas Dataframe with one row per hand labeled mention: `seed` (the seed mention ID naming the file) and `mention_id`.
+A mention found in several files is kept in the first one only (see safety_checks.duplicate_report()).
+Raises a ValueError naming the files that could not be read, rather than benchmarking without them.
+"""
+def hand_labeled_clusters(directory_path=DIRECTORY_PATH):
+    files = sorted(file for file in os.listdir(directory_path) if file.endswith((".csv", ".parquet")))
+    results = list(validate_files(directory_path, files))
+    errors = [f"{check['file']}: {check['desc']}" for result in results for check in result["checks"]
+              if check["message"] == "ERROR"]
+    if len(errors) > 0:
+        raise ValueError("Could not read hand labeled files:\n" + "\n".join(errors))
+    frames = [pd.DataFrame({"seed": os.path.splitext(result["file"])[0], "mention_id": sorted(result["mention_ids"])})
+              for result in results]
+    labels = pd.concat(frames, ignore_index=True)
+    return labels.drop_duplicates(subset="mention_id", ignore_index=True)
+
+
+"""
+Parameters
+----------
+input_path : str
+    Path to the PatentsView g_persistent_assignee.tsv.zip bulk download file
+disamb_columns : list of str
+    Disambiguation snapshot columns to read
+mention_ids : collection of str
+    Mention IDs to keep
+chunksize : int
+    Number of rows per chunk
+
+Returns
+-------
+Pandas Dataframe indexed by mention ID with the `disamb_columns` of the rows of `mention_ids`, read in one streaming pass
+"""
+def persistent_mentions(input_path, disamb_columns, mention_ids, chunksize=1_000_000):
+    mention_ids = pd.Index(mention_ids)
+    chunks = []
+    for chunk in read_persistent_assignee(input_path, ["patent_id", "assignee_sequence"] + disamb_columns, chunksize):
+        chunk.index = "US" + chunk["patent_id"] + "-" + chunk["assignee_sequence"]
+        chunks.append(chunk.loc[chunk.index.isin(mention_ids), disamb_columns])
+    return pd.concat(chunks)
+
+
+"""
+Parameters
+----------
+labels : Pandas Dataframe
+    Hand labeled clusters, from hand_labeled_clusters()
+sample : Pandas Dataframe
+    Sample file written by assignee.sample_mentions(), with `sample_weight` (and `cluster_size_bucket` if stratified)
+strata : list of int or None
+    Cluster size bucket edges used to draw the sample, None for uniform sampling
+cluster_size : Pandas Series or None
+    Size in the sampled snapshot of each hand labeled mention's cluster, indexed like `labels`, <NA> for mentions
+    missing from that snapshot. Required with `strata`.
+
+Returns
+-------
+Pandas Series indexed by seed mention ID with the weight of each hand labeled cluster: the inverse of the sum of the
+inclusion probabilities of its mentions, which is the probability of reaching the cluster through one sampled mention.
+Mentions are included with probability 1 / sample_weight of their stratum (a single stratum for uniform sampling).
+Mentions missing from the sampled snapshot could not have been sampled, so their inclusion probability is 0.
+"""
+def cluster_weights(labels, sample, strata=None, cluster_size=None):
+    if strata is None:
+        inclusion = pd.Series(1 / sample["sample_weight"].iloc[0], index=labels.index)
+    else:
+        bucket_weights = sample.groupby("cluster_size_bucket")["sample_weight"].first()
+        known = cluster_size.dropna()
+        buckets = cluster_size_bucket(known, strata).map(bucket_labels(strata)).reindex(cluster_size.index)
+        inclusion = 1 / buckets.map(bucket_weights)
+    return 1 / inclusion.fillna(0).groupby(labels["seed"]).sum()
+
+
+"""
+Parameters
+----------
+labels : Pandas Dataframe
+    Hand labeled clusters, from hand_labeled_clusters()
+predicted : Pandas Series
+    Predicted cluster (disambiguated assignee ID) of each hand labeled mention, indexed like `labels`. Missing
+    mentions are treated as singletons.
+predicted_sizes : Pandas Series
+    Size of every predicted cluster over the full persistent table, indexed by disambiguated assignee ID
+
+Returns
+-------
+Pandas Dataframe with one row per hand labeled cluster: its size, and its number of true pairs (pairs of the cluster),
+of predicted pairs (pairs in the predicted clusters that involve its mentions, counting each pair once across clusters)
+and of true positive pairs (pairs of the cluster that are predicted together)
+"""
+def cluster_pair_counts(labels, predicted, predicted_sizes):
+    # Mentions without a prediction are singletons, with a cluster of their own
+    missing = predicted.isna()
+    predicted = predicted.astype(object).where(~missing, "missing:" + labels["mention_id"])
+    sizes = predicted.map(predicted_sizes).where(~missing, 1).astype("int64")
+
+    # Contingency table between hand labeled and predicted clusters
+    table = pd.DataFrame({"seed": labels["seed"], "predicted": predicted, "predicted_size": sizes})\
+        .groupby(["seed", "predicted"]).agg(n=("predicted_size", "size"), predicted_size=("predicted_size", "first"))
+    table["true_positive_pairs"] = table["n"] * (table["n"] - 1) / 2
+    table["predicted_pairs"] = table["n"] * (table["predicted_size"] - 1) / 2
+
+    counts = table.groupby(level="seed").agg(size=("n", "sum"), true_positive_pairs=("true_positive_pairs", "sum"),
+                                             predicted_pairs=("predicted_pairs", "sum"))
+    counts["true_pairs"] = counts["size"] * (counts["size"] - 1) / 2
+    return counts
+
+
+"""
+Parameters
+----------
+counts : Pandas Dataframe
+    Pair counts of each hand labeled cluster, from cluster_pair_counts()
+weights : Pandas Series
+    Weight of each hand labeled cluster, from cluster_weights()
+
+Returns
+-------
+Dictionary with the ratio estimators of pairwise precision, recall and F1 of the disambiguation: weighted sums of
+true positive pairs over weighted sums of predicted pairs (precision) or of true pairs (recall)
+"""
+def pairwise_estimates(counts, weights):
+    weights = weights.reindex(counts.index)
+    true_positives = (weights * counts["true_positive_pairs"]).sum()
+    precision = true_positives / (weights * counts["predicted_pairs"]).sum()
+    recall = true_positives / (weights * counts["true_pairs"]).sum()
+    return {"clusters": len(counts.index), "mentions": int(counts["size"].sum()), "precision": precision,
+            "recall": recall, "f1": 2 * precision * recall / (precision + recall)}
+
+
+"""
+Parameters
+----------
+disamb_columns : list of str or None
+    Disambiguation snapshot columns to benchmark, defaults to every `disamb_assignee_id_*` column of the bulk file
+sampled_column : str
+    Snapshot column the sample was drawn from, which decides the strata of stratified samples
+strata : list of int or None
+    Cluster size bucket edges passed to assignee.sample_mentions(), None for uniform sampling
+directory_path, sample_path, input_path, output_dir : str
+    Hand labeled files, sample file of sample_mentions(), bulk file and output folder
+chunksize : int
+    Number of rows of the bulk file read at a time
+
+Output
+------
+Saves `benchmark_summary.csv` (estimated pairwise precision, recall and F1 of every snapshot column) and
+`benchmark_by_cluster.csv` (pair counts and weight of every hand labeled cluster for every snapshot column) in
+`output_dir`. The bulk file is read in two streaming passes whatever the number of snapshot columns.
+"""
+def benchmark(disamb_columns=None, sampled_column="disamb_assignee_id_20230629", strata=None,
+              directory_path=DIRECTORY_PATH, sample_path=SAMPLE_PATH, input_path="g_persistent_assignee.tsv.zip",
+              output_dir=OUTPUT_DIR, chunksize=1_000_000):
+    if disamb_columns is None:
+        header = pd.read_csv(input_path, sep="\t", compression="zip", nrows=0).columns
+        disamb_columns = [column for column in header if column.startswith("disamb_assignee_id_")]
+    columns = list(dict.fromkeys(disamb_columns + [sampled_column]))
+
+    # Hand labeled clusters, the predicted cluster of their mentions and the size of every predicted cluster
+    labels = hand_labeled_clusters(directory_path)
+    sizes = count_cluster_sizes(input_path, columns, chunksize)
+    predicted = persistent_mentions(input_path, columns, labels["mention_id"], chunksize)
+    predicted = predicted[~predicted.index.duplicated()].reindex(labels["mention_id"]).set_index(labels.index)
+
+    sample = pd.read_csv(sample_path)
+    weights = cluster_weights(labels, sample, strata, predicted[sampled_column].map(sizes[sampled_column]))
+
+    summary = []
+    by_cluster = []
+    for column in disamb_columns:
+        counts = cluster_pair_counts(labels, predicted[column], sizes[column])
+        summary.append({"disamb_column": column, **pairwise_estimates(counts, weights)})
+        by_cluster.append(counts.assign(disamb_column=column, weight=weights.reindex(counts.index)).reset_index())
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    summary = pd.DataFrame(summary)
+    summary.to_csv(os.path.join(output_dir, "benchmark_summary.csv"), index=False)
+    pd.concat(by_cluster, ignore_index=True).to_csv(os.path.join(output_dir, "benchmark_by_cluster.csv"), index=False)
+    return summary
+
+if __name__ == "__main__":
+    # Usage: python benchmark.py [<disamb_column> ...]
+    print(benchmark(sys.argv[1:] or None).to_string(index=False))
@@ -0,0 +1,202 @@
+from rapidfuzz import fuzz, process
+from parallel import parallel_map
+from candidates import snapshot_references
+from snapshot import SNAPSHOT_DIR
+from storage import read_table, write_table
+from names import fold, strip_suffixes, acronym, soundex
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+SAMPLE_PATH = "data/02 - sample_with_data.parquet"
+OUTPUT_PATH = "data/04 - candidates.parquet"
+KEY_TYPES = ["initials", "sorted", "phonetic"]
+BLOCK_LABELS = {mask: ",".join(key_type for bit, key_type in enumerate(KEY_TYPES) if mask & (1 << bit))
+                for mask in range(1, 1 << len(KEY_TYPES))} # Bit mask of shared key types -> "initials,phonetic"
+MAX_BLOCK_SIZE = 5000 # Blocks with more references (such as the initial of one-word names) are too broad to be useful
+CANDIDATES_SIZE = 50 # Assignee IDs kept per sampled mention
+PARALLEL_MIN_MENTIONS = 200
+RESULT_COLS = ['mention_id', 'rank', 'assignee_id', 'score', 'blocks', 'reference_count', 'assignee_reference_id',
+               'assignee_organization', 'assignee_individual_name_first', 'assignee_individual_name_last',
+               'assignee_type', 'assignee_city', 'assignee_state', 'assignee_country']
+
+
+"""
+Parameters
+----------
+organization, name_first, name_last : Pandas Series
+    Name fields of assignee mentions or references
+
+Returns
+-------
+Pandas Series of folded names: the organization, or "<first name> <last name>" for individuals
+"""
+def full_names(organization, name_first, name_last):
+    individual = (name_first.fillna("") + " " + name_last.fillna("")).str.strip()
+    return organization.fillna("").where(organization.fillna("").str.strip() != "", individual).map(fold)
+
+
+"""
+Parameters
+----------
+name : str
+    Folded name, from full_names()
+
+Returns
+-------
+Dictionary of the blocking keys of `name`, by key type:
+    - initials: first letter of every token of the name without corporate suffixes ("ibm" for "International
+      Business Machines Corp."). One-word names of up to 5 letters are their own key, to meet the names they abbreviate.
+    - sorted: tokens of the name without corporate suffixes, sorted, for names written in another order
+    - phonetic: sorted Soundex codes of these tokens, for misspellings ("Micrsoft")
+"""
+def blocking_keys(name):
+    stripped = strip_suffixes(name)
+    tokens = stripped.split()
+    if len(tokens) == 0:
+        return {}
+    initials = acronym(stripped) or (stripped if len(stripped) <= 5 else stripped[0])
+    return {"initials": initials, "sorted": " ".join(sorted(tokens)),
+            "phonetic": " ".join(sorted(soundex(token) for token in tokens))}
+
+
+"""
+Parameters
+----------
+names : Pandas Series
+    Folded names, from full_names()
+
+Returns
+-------
+Pandas Dataframe with one row per name and blocking key: the index of the name in `names`, `key_type` and `key`.
+Keys are computed once per distinct name.
+"""
+def name_keys(names):
+    distinct = pd.Series(names.unique())
+    keys = pd.DataFrame([blocking_keys(name) for name in distinct], columns=KEY_TYPES, index=distinct)
+    keys = keys.rename_axis("name").reset_index().melt(id_vars="name", var_name="key_type", value_name="key").dropna()
+    keys = pd.DataFrame({"name": names.to_numpy(), "position": np.arange(len(names))}).merge(keys, on="name")
+    return keys.drop(columns="name")
+
+
+"""
+Parameters
+----------
+references : Pandas Dataframe
+    Assignee references, from candidates.snapshot_references()
+
+Returns
+-------
+Pandas Dataframe of the blocking index, one row per (key_type, key) and reference position in `references`, without
+the blocks of more than MAX_BLOCK_SIZE references
+"""
+def block_references(references):
+    keys = name_keys(references["name"])
+    block_sizes = keys.groupby(["key_type", "key"])["position"].transform("size")
+    return keys[block_sizes <= MAX_BLOCK_SIZE].rename(columns={"position": "reference"})
+
+
+"""
+Parameters
+----------
+pairs : Pandas Dataframe
+    Candidate pairs of a set of mentions, sorted by mention, with `mention_id`, the folded names `query` and `name`,
+    the bit mask of shared key types `key_types` and the assignee reference fields
+
+Returns
+-------
+Pandas Dataframe with the CANDIDATES_SIZE best assignee IDs of every mention: pairs are scored with rapidfuzz WRatio,
+and each assignee ID keeps its best reference, with the number of its references that were blocked with the mention
+"""
+def rank_candidates(pairs):
+    # Score the names of each mention's block against its query in one call
+    mention_ids = pairs["mention_id"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, mention_ids[1:] != mention_ids[:-1]])
+    ends = np.r_[starts[1:], len(mention_ids)]
+    queries, names = pairs["query"].to_numpy(), pairs["name"].to_numpy()
+    scores = np.empty(len(mention_ids), dtype=np.float32)
+    for start, end in zip(starts, ends):
+        scores[start:end] = process.cdist([queries[start]], names[start:end], scorer=fuzz.WRatio, workers=1)[0]
+
+    ranked = pairs.assign(score=scores).sort_values(["mention_id", "score", "mention_count"], ascending=[True, False, False])
+    ranked["reference_count"] = ranked.groupby(["mention_id", "assignee_id"], dropna=False)["mention_id"].transform("size")
+    ranked = ranked.drop_duplicates(subset=["mention_id", "assignee_id"])
+    ranked["rank"] = ranked.groupby("mention_id").cumcount() + 1
+    ranked = ranked[ranked["rank"] <= CANDIDATES_SIZE]
+    ranked["blocks"] = ranked["key_types"].map(BLOCK_LABELS)
+    return ranked[RESULT_COLS].reset_index(drop=True)
+
+
+"""
+Parameters
+----------
+pairs : Pandas Dataframe
+    Candidate pairs, see rank_candidates()
+workers : int
+    Number of worker processes, defaults to the number of CPUs
+
+Returns
+-------
+Pandas Dataframe of ranked candidates. Mentions are split in chunks, four per worker, which are ranked in parallel
+(see parallel.parallel_map()); fewer than PARALLEL_MIN_MENTIONS mentions are ranked in this process. Rows are sorted
+by mention whatever the number of workers.
+"""
+def rank_all(pairs, workers=None):
+    workers = workers or os.cpu_count() or 1
+    mention_ids = np.sort(pairs["mention_id"].unique())
+    if workers == 1 or len(mention_ids) < PARALLEL_MIN_MENTIONS:
+        return rank_candidates(pairs)
+    chunks = np.array_split(mention_ids, 4 * workers)
+    chunk_of = pd.Series(np.repeat(np.arange(len(chunks)), [len(chunk) for chunk in chunks]), index=mention_ids)
+    groups = [group for _, group in pairs.groupby(pairs["mention_id"].map(chunk_of).to_numpy())]
+    return pd.concat(parallel_map(rank_candidates, groups, workers=workers), ignore_index=True)
+
+
+"""
+Parameters
+----------
+sample_path : str
+    Sample file written by assignee.populate_sample()
+snapshot_dir : str
+    Folder of the Parquet snapshot of rawassignee_for_hand_labeling (see snapshot.py), from which assignee references
+    are built
+output_path : str
+    Path to Parquet (or CSV) file for saving the candidates
+workers : int
+    Number of worker processes, defaults to the number of CPUs
+
+Output
+------
+Saves, for every sampled mention, its CANDIDATES_SIZE best assignee IDs among the references that share a blocking key
+with it (see blocking_keys()), ranked by name similarity: `rank`, `score` (0 to 100), the key types shared (`blocks`)
+and the fields of the best reference of each assignee ID. The app shows them for the mention without a live search.
+"""
+def generate_candidates(sample_path=SAMPLE_PATH, snapshot_dir=SNAPSHOT_DIR, output_path=OUTPUT_PATH, workers=None):
+    references = snapshot_references(snapshot_dir)
+    references["name"] = full_names(references["assignee_organization"], references["assignee_individual_name_first"],
+                                    references["assignee_individual_name_last"])
+    index = block_references(references)
+
+    sample = read_table(sample_path)
+    mentions = pd.DataFrame({"mention_id": "US" + sample["patent_id"] + "-" + sample["assignee_sequence"].astype(str),
+                             "query": full_names(sample["organization"], sample["name_first"], sample["name_last"])})
+    mentions = mentions.drop_duplicates(subset="mention_id", ignore_index=True)
+
+    # Candidate pairs: references sharing at least one blocking key with the mention, with the key types shared
+    pairs = name_keys(mentions["query"]).merge(index, on=["key_type", "key"])
+    pairs["key_types"] = pairs["key_type"].map({key_type: 1 << bit for bit, key_type in enumerate(KEY_TYPES)})
+    pairs = pairs.groupby(["position", "reference"])["key_types"].sum().reset_index()
+    pairs = pairs.join(mentions, on="position").join(references, on="reference").drop(columns=["position", "reference"])
+
+    candidates = rank_all(pairs, workers)
+    if os.path.dirname(output_path) and not os.path.exists(os.path.dirname(output_path)):
+        os.makedirs(os.path.dirname(output_path))
+    write_table(candidates, output_path, index=False)
+    print(candidates["mention_id"].nunique(), "of", len(mentions.index), "mentions with candidates")
+    return candidates
+
+if __name__ == "__main__":
+    # Usage: python blocking.py [<sample_path> [<output_path>]]
+    args = sys.argv[1:3]
+    generate_candidates(*args[:1], output_path=args[1] if len(args) > 1 else OUTPUT_PATH)
@@ -0,0 +1,109 @@
+from sklearn.feature_extraction.text import TfidfVectorizer
+from rapidfuzz import fuzz, process
+from snapshot import query_snapshot, SNAPSHOT_DIR
+from names import fold
+import numpy as np
+
+SEARCH_FIELDS = ['assignee_organization', 'assignee_individual_name_first', 'assignee_individual_name_last']
+REFERENCE_COLS = ['assignee_organization', 'assignee_individual_name_first', 'assignee_individual_name_last',
+                  'assignee_city', 'assignee_state', 'assignee_country', 'assignee_type', 'assignee_id']
+SOURCE_COLS = ['patent_id', 'assignee_sequence', 'assignee', 'assignee_organization', 'assignee_individual_name_first',
+               'asassignee_individual_name_last', 'assignee_city', 'assignee_state', 'assignee_country', 'assignee_type']
+NGRAM_RANGE = (3, 3)
+SHORTLIST_SIZE = 500 # Candidates kept from the n-gram index before rapidfuzz scoring
+
+
+"""
+Parameters
+----------
+mentions : Pandas Dataframe
+    Rows of the rawassignee_for_hand_labeling view (or its snapshot)
+
+Returns
+-------
+Pandas Dataframe of assignee references, with the same fields as the Elasticsearch `assignee_references` index: one
+row per distinct combination of disambiguated assignee ID, names, location and type, with the number of mentions it
+covers. `assignee_reference_id` is the first mention ID of the reference, so it is stable across rebuilds.
+"""
+def build_references(mentions):
+    df = mentions.rename(columns={'assignee': 'assignee_id', 'asassignee_individual_name_last': 'assignee_individual_name_last'})
+    df = df.assign(mention_id="US" + df['patent_id'].astype(str) + "-" + df['assignee_sequence'].astype(str))
+    df = df.sort_values(['patent_id', 'assignee_sequence'])
+    keys = df[REFERENCE_COLS].astype(object).where(df[REFERENCE_COLS].notna(), "")
+    references = df.groupby([keys[col] for col in REFERENCE_COLS], sort=False)\
+        .agg(assignee_reference_id=('mention_id', 'first'), mention_count=('mention_id', 'size')).reset_index()
+    return references.replace({col: {"": None} for col in REFERENCE_COLS})
+
+
+"""
+Assignee references of the Parquet snapshot in `snapshot_dir`, see build_references(). Only the columns they are built
+from are read, not the titles and abstracts.
+"""
+def snapshot_references(snapshot_dir=SNAPSHOT_DIR):
+    return build_references(query_snapshot(None, snapshot_dir, SOURCE_COLS))
+
+
+"""
+Local candidate generation over assignee references, as an offline replacement for the Elasticsearch search of the
+app. For each searched field, names are folded (lower case, no diacritics or punctuation) once and indexed by
+character n-grams in a sparse TF-IDF inverted index. A query is matched against the index with one sparse product to
+shortlist candidates, which are then scored with rapidfuzz.
+"""
+class CandidateIndex:
+    def __init__(self, references):
+        self.references = references.reset_index(drop=True)
+        self.indexes = {}
+
+    @classmethod
+    def from_snapshot(cls, snapshot_dir=SNAPSHOT_DIR):
+        return cls(snapshot_references(snapshot_dir))
+
+    """
+    Returns the folded names, fitted vectorizer and inverted index of `field` (a sparse n-gram x reference matrix whose
+    rows are posting lists), built on first use
+    """
+    def field_index(self, field):
+        if field not in self.indexes:
+            names = self.references[field].fillna("").map(fold)
+            vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=NGRAM_RANGE, lowercase=False, dtype=np.float32)
+            matrix = vectorizer.fit_transform(names)
+            self.indexes[field] = (names.to_numpy(), vectorizer, matrix.T.tocsr())
+        return self.indexes[field]
+
+    """
+    Parameters
+    ----------
+    user_query : str
+        Name to search for
+    field : str
+        One of SEARCH_FIELDS
+    size : int
+        Maximum number of results
+    collapse : Boolean
+        Keep only the best reference of each assignee ID, with the number of matching references
+
+    Returns
+    -------
+    List of dictionaries with the fields of parse_results() and a `score` between 0 and 100, best first
+    """
+    def search(self, user_query, field="assignee_organization", size=50, collapse=False):
+        names, vectorizer, inverted_index = self.field_index(field)
+        query = fold(user_query)
+        if len(query) == 0:
+            return []
+
+        # Shortlist by n-gram similarity, only visiting the posting lists of the query's n-grams, then score the
+        # shortlist by edit distance
+        similarity = (vectorizer.transform([query]) @ inverted_index).tocsr()
+        shortlist, similarity = similarity.indices, similarity.data
+        if len(shortlist) > SHORTLIST_SIZE:
+            shortlist = shortlist[np.argpartition(-similarity, SHORTLIST_SIZE)[:SHORTLIST_SIZE]]
+        scores = process.cdist([query], names[shortlist], scorer=fuzz.WRatio, workers=1)[0]
+
+        results = self.references.iloc[shortlist].assign(score=scores)\
+            .sort_values(["score", "mention_count"], ascending=False)
+        if collapse:
+            counts = results.groupby("assignee_id", dropna=False)["assignee_id"].transform("size")
+            results = results.assign(reference_count=counts).drop_duplicates(subset="assignee_id")
+        results = results.head(size).drop(columns="mention_count")
+        return results.astype(object).where(results.notna(), None).to_dict(orient="records")
@@ -1,44 +1,69 @@
 import pandas as pd
+from storage import read_table, write_table, find_table
 import sys
 import os
 
-# Read user input
 INPUT_DIR = "data/06 - compare/"
 OUTPUT_DIR = "data/07 - evaluation/"
-MENTION_ID = sys.argv[1]
-labeler1 = sys.argv[2]
-labeler2 = sys.argv[3]
 
-# Load in user data
-f1_path = os.path.join(INPUT_DIR, MENTION_ID + "-" + labeler1 + ".csv")
-f2_path = os.path.join(INPUT_DIR, MENTION_ID + "-" + labeler2 + ".csv")
-file1 = pd.read_csv(f1_path, index_col=0, dtype={'patent_id': str, 'assignee_state': object})
-file2 = pd.read_csv(f2_path, index_col=0, dtype={'patent_id': str, 'assignee_state': object})
-print("Done reading the files.")
 
 """
-# Add a column to indicate the labeler
-merge_cols = list(file1.columns)
-file1[labeler1] = True
-file2[labeler2] = True
-
-# Merge the two DataFrames using an outer join on all columns
-merged = pd.merge(file1, file2, on=merge_cols, how='outer')
-merged[labeler1].fillna(False, inplace=True)
-merged[labeler2].fillna(False, inplace=True)
+Returns the path of the file of `labeler` for the cluster of `mention_id` (Parquet if it exists, otherwise CSV)
 """
+def labeler_path(mention_id, labeler, input_dir=INPUT_DIR):
+    return find_table(os.path.join(input_dir, mention_id + "-" + labeler))
 
-# Merge not working properly, using set operations instead
-file1_patents = set(file1.patent_id) - set(file2.patent_id)
-file2_patents = set(file2.patent_id) - set(file1.patent_id)
-file1_diff = file1[file1.patent_id.isin(file1_patents)].copy()
-file2_diff = file2[file2.patent_id.isin(file2_patents)].copy()
-file1_diff["Labeler"] = labeler1
-file2_diff["Labeler"] = labeler2
-merged = pd.concat([file1_diff, file2_diff])
-print("Done merging the files.")
-
-# Filter rows where both 'File1' and 'File2' are False
-output_path = os.path.join(OUTPUT_DIR, MENTION_ID + "-difference.csv")
-merged.to_csv(output_path, index=False)
-print("Successfully saved the output file.")
\ No newline at end of file
+
+def load_file(path):
+    return read_table(path, index_col=0)
+
+
+"""
+Parameters
+----------
+file1, file2 : Pandas Dataframes
+    Hand labeled files of the same cluster by two labelers
+labeler1, labeler2 : str
+    Names of the labelers
+
+Returns
+-------
+Pandas Dataframe with the rows of patents only one labeler included, with a `Labeler` column naming who included them
+"""
+def compare_files(file1, file2, labeler1, labeler2):
+    # Merge not working properly, using set operations instead
+    file1_patents = set(file1.patent_id) - set(file2.patent_id)
+    file2_patents = set(file2.patent_id) - set(file1.patent_id)
+    file1_diff = file1[file1.patent_id.isin(file1_patents)].copy()
+    file2_diff = file2[file2.patent_id.isin(file2_patents)].copy()
+    file1_diff["Labeler"] = labeler1
+    file2_diff["Labeler"] = labeler2
+    return pd.concat([file1_diff, file2_diff])
+
+
+"""
+Returns the path of the output of compare() for the cluster of `mention_id`. Passing the labelers names the file after
+them, for clusters compared by more than one pair of labelers.
+"""
+def output_path(mention_id, output_dir=OUTPUT_DIR, labeler1=None, labeler2=None):
+    if labeler1 is not None:
+        return os.path.join(output_dir, mention_id + "-" + labeler1 + "-" + labeler2 + "-difference.csv")
+    return os.path.join(output_dir, mention_id + "-difference.csv")
+
+
+def compare(mention_id, labeler1, labeler2, input_dir=INPUT_DIR, output_dir=OUTPUT_DIR):
+    # Load in user data
+    file1 = load_file(labeler_path(mention_id, labeler1, input_dir))
+    file2 = load_file(labeler_path(mention_id, labeler2, input_dir))
+    print("Done reading the files.")
+
+    merged = compare_files(file1, file2, labeler1, labeler2)
+    print("Done merging the files.")
+
+    # Filter rows where both 'File1' and 'File2' are False
+    write_table(merged, output_path(mention_id, output_dir), index=False)
+    print("Successfully saved the output file.")
+
+if __name__ == "__main__":
+    # Read user input
+    compare(sys.argv[1], sys.argv[2], sys.argv[3])
\ No newline at end of file
@@ -0,0 +1,161 @@
+from sqlalchemy import create_engine, event, text, bindparam
+from dotenv import dotenv_values
+from collections import deque
+import pandas as pd
+import contextlib
+import functools
+import itertools
+import time
+
+POOL_SIZE = 5        # Connections kept open, enough for a handful of concurrent labelers
+MAX_OVERFLOW = 10    # Extra connections allowed during bursts
+POOL_RECYCLE = 1800  # Seconds before a connection is replaced, well under the server's idle timeout
+POOL_TIMEOUT = 30    # Seconds to wait for a free connection
+IN_LIST_LIMIT = 1000 # Larger ID lists are joined through a temporary table instead of an IN (...) list
+STREAM_CHUNKSIZE = 10_000
+QUERY_METRICS = deque(maxlen=1000)
+TEMP_TABLE_IDS = itertools.count()
+
+
+"""
+Process-wide SQLAlchemy engine for the PV database, created once from the environmental variables in `env_path`.
+Connections are pooled and checked with a ping before use, so every extraction and mention lookup reuses a warm
+connection instead of paying the TCP, TLS and MySQL handshakes again.
+
+Returns
+-------
+engine : a PyMySQL engine object
+"""
+@functools.lru_cache(maxsize=None)
+def get_engine(env_path=".env"):
+    config = dotenv_values(env_path)
+    user = config['user']
+    pswd = config['password']
+    hostname = config['hostname']
+    dbname = config['dbname']
+    engine = create_engine(f"mysql+pymysql://{user}:{pswd}@{hostname}/{dbname}?charset=utf8mb4",
+                           pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_recycle=POOL_RECYCLE,
+                           pool_timeout=POOL_TIMEOUT, pool_pre_ping=True)
+    event.listen(engine, "before_cursor_execute", start_query_timer)
+    event.listen(engine, "after_cursor_execute", record_query_time)
+    return engine
+
+
+def start_query_timer(connection, cursor, statement, parameters, context, executemany):
+    context.query_start_time = time.perf_counter()
+
+
+def record_query_time(connection, cursor, statement, parameters, context, executemany):
+    # Streamed results are fetched after this event and have no row count yet, stream_query() records them instead
+    if context.execution_options.get("stream_results", False):
+        return
+    record_query(statement, time.perf_counter() - context.query_start_time, cursor.rowcount)
+
+
+def record_query(statement, seconds, rows):
+    QUERY_METRICS.append({
+        "timestamp": time.time(),
+        "statement": " ".join(str(statement).split())[:200],
+        "seconds": seconds,
+        "rows": rows,
+    })
+
+
+"""
+Returns
+-------
+Pandas Dataframe with the timing of the most recent queries run through get_engine(), one row per query
+"""
+def query_metrics():
+    return pd.DataFrame(list(QUERY_METRICS), columns=["timestamp", "statement", "seconds", "rows"])
+
+
+"""
+Parameters
+----------
+connection : sqlalchemy.engine.base.Connection
+    Connection using sqlalchemy to the PV database.
+query : str or sqlalchemy TextClause
+    Query with bound parameters, such as "... WHERE r.patent_id = :patent_id"
+params : dict
+    Values of the bound parameters
+chunksize : int
+    Number of rows per chunk
+
+Returns
+-------
+Iterator over Pandas Dataframes of at most `chunksize` rows (a single empty one if there are no results). Rows are
+fetched with a server-side cursor, so the full result never has to fit in memory. The query is recorded in the query
+metrics once the result is consumed, with the rows fetched and the time spent executing and fetching.
+"""
+def stream_query(connection, query, params=None, chunksize=STREAM_CHUNKSIZE):
+    query = text(query) if isinstance(query, str) else query
+    start_time = time.perf_counter()
+    result = connection.execute(query, params or {}, execution_options={"stream_results": True})
+    rows = 0
+    try:
+        columns = list(result.keys())
+        for partition in result.partitions(chunksize):
+            rows += len(partition)
+            yield pd.DataFrame(partition, columns=columns)
+        if rows == 0:
+            yield pd.DataFrame(columns=columns)
+    finally:
+        result.close()
+        record_query(query, time.perf_counter() - start_time, rows)
+
+
+"""
+Parameters
+----------
+connection : sqlalchemy.engine.base.Connection
+    Connection using sqlalchemy to the PV database.
+values : list of str
+    Values to load, such as disambiguated assignee IDs
+column : str
+    Column name of the temporary table
+
+Yields the name of a temporary table holding `values`, to be joined with instead of an `IN (...)` list. The table
+only exists for the current connection and is dropped on exit.
+"""
+@contextlib.contextmanager
+def id_table(connection, values, column="id", length=64):
+    name = f"tmp_{column}_{next(TEMP_TABLE_IDS)}"
+    connection.execute(text(f"CREATE TEMPORARY TABLE {name} ({column} VARCHAR({length}) NOT NULL PRIMARY KEY)"))
+    try:
+        connection.execute(text(f"INSERT IGNORE INTO {name} ({column}) VALUES (:value)"),
+                           [{"value": value} for value in values])
+        yield name
+    finally:
+        connection.execute(text(f"DROP TEMPORARY TABLE IF EXISTS {name}"))
+
+
+"""
+Parameters
+----------
+connection : sqlalchemy.engine.base.Connection
+    Connection using sqlalchemy to the PV database.
+table : str
+    Table or view to select from
+column : str
+    Column matched against `values`
+values : list of str
+    Values to select
+chunksize : int
+    Number of rows per chunk
+
+Returns
+-------
+Iterator over Pandas Dataframes with the result of `SELECT * FROM table WHERE column IN (values)`. Short lists are
+sent as one expanding bound parameter, long lists are loaded in a temporary table and joined.
+"""
+def stream_where_in(connection, table, column, values, chunksize=STREAM_CHUNKSIZE):
+    values = list(dict.fromkeys(values))
+    if len(values) <= IN_LIST_LIMIT:
+        query = text(f"SELECT * FROM {table} r WHERE r.{column} IN :values")\
+            .bindparams(bindparam("values", expanding=True))
+        yield from stream_query(connection, query, {"values": values}, chunksize)
+    else:
+        with id_table(connection, values, column) as ids:
+            query = f"SELECT r.* FROM {table} r JOIN {ids} t ON r.{column} = t.{column}"
+            yield from stream_query(connection, query, None, chunksize)
@@ -0,0 +1,161 @@
+import pandas as pd
+import numpy as np
+from batch_compare import load_files
+import compare
+import sys
+import os
+
+INPUT_DIR = compare.INPUT_DIR
+OUTPUT_DIR = compare.OUTPUT_DIR
+
+
+"""
+Parameters
+----------
+input_dir : str
+    Folder of labeler files, named "<seed mention ID>-<labeler>.csv" (or .parquet)
+
+Returns
+-------
+Pandas Dataframe with one row per labeler file: `mention_id`, `labeler` and `path`
+"""
+def labeler_files(input_dir=INPUT_DIR):
+    files = sorted(file for file in os.listdir(input_dir) if file.endswith((".csv", ".parquet")))
+    stems = [os.path.splitext(file)[0].rsplit("-", 1) for file in files]
+    return pd.DataFrame({"mention_id": [stem[0] for stem in stems], "labeler": [stem[1] for stem in stems],
+                         "path": [os.path.join(input_dir, file) for file in files]})
+
+
+"""
+Parameters
+----------
+files : Pandas Dataframe
+    Labeler files, from labeler_files()
+
+Returns
+-------
+Pandas Dataframe with one row per (seed mention, labeler, labeled mention): `mention_id`, `labeler` and `item`, the
+integer code of the labeled mention ("US<patent_id>-<assignee_sequence>"), shared across all files
+"""
+def labeled_items(files):
+    loaded = load_files(files["path"].tolist())
+    frames = []
+    for row in files.itertuples(index=False):
+        df = loaded[row.path]
+        items = "US" + df["patent_id"] + "-" + df["assignee_sequence"].astype(str)
+        frames.append(pd.DataFrame({"mention_id": row.mention_id, "labeler": row.labeler, "item": items.to_numpy()}))
+    items = pd.concat(frames, ignore_index=True).drop_duplicates(ignore_index=True)
+    items["item"] = pd.factorize(items["item"])[0]
+    return items
+
+
+def f1(precision, recall):
+    return 2 * precision * recall / (precision + recall)
+
+
+"""
+Parameters
+----------
+items : Pandas Dataframe
+    Labeled mentions, from labeled_items()
+
+Returns
+-------
+Pandas Dataframe with one row per seed mention and pair of labelers who labeled it (`labeler1` < `labeler2`), with the
+sizes of both clusters, their intersection and union, and agreement metrics taking `labeler1` as the reference:
+    - jaccard: |intersection| / |union|
+    - pairwise precision and recall: share of the pairs of mentions grouped by `labeler2` (resp. `labeler1`) that
+      are also grouped by the other labeler
+    - B-cubed precision and recall: average over the mentions of `labeler2` (resp. `labeler1`) of the share of its
+      cluster shared with the other labeler, mentions outside the other labeler's cluster counting as singletons
+"""
+def mention_agreement(items):
+    sizes = items.groupby(["mention_id", "labeler"]).size().rename("size").reset_index()
+
+    # Every pair of labelers of the same seed mention, and the size of the intersection of their clusters
+    pairs = sizes.merge(sizes, on="mention_id", suffixes=("1", "2"))
+    pairs = pairs.loc[pairs["labeler1"] < pairs["labeler2"], ["mention_id", "labeler1", "labeler2", "size1", "size2"]]
+    shared = items.merge(items, on=["mention_id", "item"], suffixes=("1", "2"))
+    shared = shared[shared["labeler1"] < shared["labeler2"]].groupby(["mention_id", "labeler1", "labeler2"]).size()
+    pairs = pairs.merge(shared.rename("intersection").reset_index(), on=["mention_id", "labeler1", "labeler2"], how="left")
+    pairs["intersection"] = pairs["intersection"].fillna(0).astype("int64")
+
+    n1, n2, shared_size = pairs["size1"], pairs["size2"], pairs["intersection"]
+    pairs["union"] = n1 + n2 - shared_size
+    pairs["only_1"] = n1 - shared_size
+    pairs["only_2"] = n2 - shared_size
+    pairs["jaccard"] = shared_size / pairs["union"]
+
+    # Pairwise counts: pairs of mentions in each cluster and in both
+    pairs["pairs1"] = n1 * (n1 - 1) // 2
+    pairs["pairs2"] = n2 * (n2 - 1) // 2
+    pairs["pairs_shared"] = shared_size * (shared_size - 1) // 2
+    pairs["pairwise_precision"] = pairs["pairs_shared"] / pairs["pairs2"].replace(0, np.nan)
+    pairs["pairwise_recall"] = pairs["pairs_shared"] / pairs["pairs1"].replace(0, np.nan)
+    pairs["pairwise_f1"] = f1(pairs["pairwise_precision"], pairs["pairwise_recall"])
+
+    # B-cubed sums over mentions: shared mentions score |intersection| / |cluster|, the others 1 / |cluster|
+    pairs["bcubed_precision_sum"] = (shared_size ** 2 + n2 - shared_size) / n2
+    pairs["bcubed_recall_sum"] = (shared_size ** 2 + n1 - shared_size) / n1
+    pairs["bcubed_precision"] = pairs["bcubed_precision_sum"] / n2
+    pairs["bcubed_recall"] = pairs["bcubed_recall_sum"] / n1
+    pairs["bcubed_f1"] = f1(pairs["bcubed_precision"], pairs["bcubed_recall"])
+    return pairs.sort_values(["labeler1", "labeler2", "jaccard", "mention_id"], ignore_index=True)
+
+
+"""
+Parameters
+----------
+by_mention : Pandas Dataframe
+    Per-mention agreement, from mention_agreement()
+
+Returns
+-------
+Pandas Dataframe with one row per pair of labelers, aggregating every seed mention they both labeled: pairwise and
+B-cubed metrics are computed from the summed counts (micro-averaged), Jaccard is averaged over seed mentions
+"""
+def agreement_summary(by_mention):
+    grouped = by_mention.groupby(["labeler1", "labeler2"])
+    summary = grouped.agg(mentions=("mention_id", "size"), exact_matches=("jaccard", lambda jaccard: (jaccard == 1).sum()),
+                          mean_jaccard=("jaccard", "mean"), min_jaccard=("jaccard", "min"),
+                          size1=("size1", "sum"), size2=("size2", "sum"), pairs1=("pairs1", "sum"), pairs2=("pairs2", "sum"),
+                          pairs_shared=("pairs_shared", "sum"), bcubed_precision_sum=("bcubed_precision_sum", "sum"),
+                          bcubed_recall_sum=("bcubed_recall_sum", "sum"))
+    summary["pairwise_precision"] = summary["pairs_shared"] / summary["pairs2"].replace(0, np.nan)
+    summary["pairwise_recall"] = summary["pairs_shared"] / summary["pairs1"].replace(0, np.nan)
+    summary["pairwise_f1"] = f1(summary["pairwise_precision"], summary["pairwise_recall"])
+    summary["bcubed_precision"] = summary["bcubed_precision_sum"] / summary["size2"]
+    summary["bcubed_recall"] = summary["bcubed_recall_sum"] / summary["size1"]
+    summary["bcubed_f1"] = f1(summary["bcubed_precision"], summary["bcubed_recall"])
+    return summary.drop(columns=["bcubed_precision_sum", "bcubed_recall_sum"]).reset_index()
+
+
+"""
+Parameters
+----------
+input_dir : str
+    Folder of labeler files, "<seed mention ID>-<labeler>.csv"
+output_dir : str
+    Folder for `agreement_summary.csv` (one row per pair of labelers) and `agreement_by_mention.csv` (one row per seed
+    mention and pair of labelers, least agreeing first)
+
+Returns
+-------
+The summary and per-mention Pandas Dataframes
+"""
+def evaluate(input_dir=INPUT_DIR, output_dir=OUTPUT_DIR):
+    items = labeled_items(labeler_files(input_dir))
+    by_mention = mention_agreement(items)
+    summary = agreement_summary(by_mention)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    summary.to_csv(os.path.join(output_dir, "agreement_summary.csv"), index=False)
+    by_mention.drop(columns=["bcubed_precision_sum", "bcubed_recall_sum"])\
+        .to_csv(os.path.join(output_dir, "agreement_by_mention.csv"), index=False)
+    return summary, by_mention
+
+if __name__ == "__main__":
+    # Usage: python evaluation.py [<input_dir> [<output_dir>]]
+    summary, by_mention = evaluate(*sys.argv[1:3])
+    print(summary.to_string(index=False))
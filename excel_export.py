@@ -0,0 +1,92 @@
+import xlsxwriter
+import numpy as np
+
+WORKBOOK_OPTIONS = {
+    "constant_memory": True,   # Rows are flushed to disk as soon as the next row starts
+    "strings_to_urls": False,  # Titles and abstracts are plain text
+    "default_date_format": "yyyy-mm-dd",
+}
+
+
+"""
+Parameters
+----------
+group_sizes : list of int
+    Number of consecutive rows in each group (such as each patent of a complex extraction)
+header_rows : int
+    Number of rows written before the first group
+
+Returns
+-------
+Dictionary from the first worksheet row of every group spanning more than one row to its last row
+"""
+def merge_ranges(group_sizes, header_rows=1):
+    group_sizes = np.asarray(group_sizes, dtype="int64")
+    ends = np.cumsum(group_sizes) + header_rows - 1
+    starts = ends - group_sizes + 1
+    multi_row = group_sizes > 1
+    return dict(zip(starts[multi_row].tolist(), ends[multi_row].tolist()))
+
+
+"""
+Parameters
+----------
+df : Pandas Dataframe
+    Data to export, with one worksheet row per row
+output : str or binary file-like object
+    Output file path, or a buffer such as io.BytesIO
+merge_columns : list of str
+    Columns whose cells are merged vertically within each group
+group_sizes : list of int
+    Number of consecutive rows of `df` in each group, required with `merge_columns`
+sheet_name : str
+    Name of the worksheet
+index : Boolean
+    Whether to write the index of `df` as the first column, with a blank header like `DataFrame.to_excel()`
+
+Output
+------
+Writes `df` to an XLSX workbook row by row with xlsxwriter in constant memory mode, see write_excel_chunks()
+"""
+def write_excel(df, output, merge_columns=(), group_sizes=None, sheet_name="Sheet1", index=False):
+    write_excel_chunks([df], output, merge_columns, group_sizes, sheet_name, index)
+
+
+"""
+Parameters
+----------
+chunks : iterable of Pandas Dataframes
+    Data to export, with the same columns in every chunk, such as the chunks of extraction.extraction_chunks()
+output, merge_columns, group_sizes, sheet_name, index :
+    Same as in write_excel(), `group_sizes` counting rows across all chunks
+
+Output
+------
+Writes the chunks to an XLSX workbook row by row with xlsxwriter in constant memory mode, the header coming from the
+first chunk. Merge ranges are computed up front and each merged cell is written when its first row is reached, so
+worksheet rows never accumulate in memory.
+"""
+def write_excel_chunks(chunks, output, merge_columns=(), group_sizes=None, sheet_name="Sheet1", index=False):
+    workbook = xlsxwriter.Workbook(output, WORKBOOK_OPTIONS)
+    worksheet = workbook.add_worksheet(sheet_name)
+    ranges = merge_ranges(group_sizes) if len(merge_columns) > 0 else {}
+    merged_until = 0
+    row = 0
+    for chunk in chunks:
+        if index:
+            chunk = chunk.reset_index(names="")
+        if row == 0:
+            worksheet.write_row(0, 0, [str(column) for column in chunk.columns])
+            merge_cols = {chunk.columns.get_loc(column) for column in merge_columns}
+        values = chunk.astype(object).where(chunk.notna(), None)
+        for row, data in enumerate(values.itertuples(index=False, name=None), start=row + 1):
+            if row in ranges:
+                for col in merge_cols:
+                    worksheet.merge_range(row, col, ranges[row], col, data[col])
+                merged_until = ranges[row]
+            for col, value in enumerate(data):
+                if value is None or (row <= merged_until and col in merge_cols):
+                    continue
+                worksheet.write(row, col, value)
+
+    workbook.close()
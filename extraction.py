@@ -1,7 +1,12 @@
-from sqlalchemy import create_engine, text
 from dotenv import dotenv_values
+from connection import get_engine, stream_query, stream_where_in, STREAM_CHUNKSIZE
+from snapshot import snapshot_available, snapshot_assignee_chunks, snapshot_mention, SNAPSHOT_DIR
+from storage import write_parquet_chunks
+from excel_export import write_excel_chunks
 import pandas as pd
 import numpy as np
+import io
+import os
 
 CONFIG = dotenv_values(".env")
 API_KEY = CONFIG['pv_api_key']
@@ -17,12 +22,50 @@ ASSIGNEE_TYPE_DICT = {
     8: "U.S. county government",
     9: "U.S. state government"
 }
+EXTRACTION_COLS = ['patent_id', 'assignee_sequence', 'patent_title', 'patent_abstract', 'patent_date', 'patent_type',\
+    'assignee', 'assignee_type', 'assignee_individual_name_first', 'asassignee_individual_name_last',\
+    'assignee_organization', 'assignee_city', 'assignee_state', 'assignee_country']
+
+NAME_COLS = ['assignee_organization', 'assignee_individual_name_first', 'assignee_individual_name_last',\
+    'asassignee_individual_name_last']
+LOCATION_COLS = ['assignee_city', 'assignee_state', 'assignee_country']
+CODE_COLS = ['assignee_state', 'assignee_country']
 
 def convert_assignee_type(type):
-    if np.isnan(type) or int(type) not in ASSIGNEE_TYPE_DICT:
+    code = pd.to_numeric(type, errors="coerce")
+    if pd.isna(code) or int(code) not in ASSIGNEE_TYPE_DICT:
         return None
     else:
-        return ASSIGNEE_TYPE_DICT[int(type)]
+        return ASSIGNEE_TYPE_DICT[int(code)]
+
+"""
+Vectorized version of convert_assignee_type(): codes (numbers or numeric strings) are looked up as a categorical
+against ASSIGNEE_TYPE_DICT, unknown or missing codes become missing values
+"""
+def convert_assignee_types(types):
+    codes = pd.to_numeric(pd.Series(types), errors="coerce")
+    codes = codes.where(codes.isin(list(ASSIGNEE_TYPE_DICT.keys())))
+    categories = pd.Categorical(codes, categories=list(ASSIGNEE_TYPE_DICT.keys()))
+    return pd.Series(categories, index=codes.index).cat.rename_categories(list(ASSIGNEE_TYPE_DICT.values()))
+
+"""
+Column normalization stage shared by the SQL extraction (run_extraction) and the Elasticsearch results
+(app.parse_results), applied to whole columns at once:
+    - assignee_type codes are converted to their meaning
+    - name and location columns have surrounding and repeated whitespace removed, and empty strings become missing
+    - state and country codes are upper-cased
+Columns missing from `df` are skipped.
+"""
+def normalize_columns(df):
+    df = df.copy()
+    if 'assignee_type' in df.columns:
+        df['assignee_type'] = convert_assignee_types(df['assignee_type'])
+    for column in [column for column in NAME_COLS + LOCATION_COLS if column in df.columns]:
+        values = df[column].astype("string").str.strip().str.replace(r"\s+", " ", regex=True)
+        if column in CODE_COLS:
+            values = values.str.upper()
+        df[column] = values.mask(values == "")
+    return df
 
 """
 Simple extraction for single mention_id from the MySQL connection with the following fields:
@@ -34,37 +77,94 @@ Simple extraction for single mention_id from the MySQL connection with the follo
     - Patent date granted
     - Patent type
     - Patent inventors
+
+Uses the local Parquet snapshot of the view (see snapshot.py) when one exists, so no database needs to be reachable.
 """
 def simple_extraction_output(mention_id):
     patent_id = mention_id.split("-")[0][2:]
     assignee_sequence = int(mention_id.split("-")[1])
+    if snapshot_available(SNAPSHOT_DIR):
+        return snapshot_mention(patent_id, assignee_sequence, SNAPSHOT_DIR).transpose().reset_index()\
+            .rename(columns={"index": "field", 0: "value"})
     engine = get_engine()
     with engine.connect() as connection:
-        query = f"SELECT * FROM rawassignee_for_hand_labeling r WHERE r.patent_id = '{patent_id}' and r.assignee_sequence = {assignee_sequence}"
-        result = connection.execute(text(query)).fetchall()
-    return pd.DataFrame(result).transpose().reset_index().rename(columns={"index": "field", 0: "value"})
+        query = "SELECT * FROM rawassignee_for_hand_labeling r WHERE r.patent_id = :patent_id and r.assignee_sequence = :assignee_sequence"
+        result = pd.concat(stream_query(connection, query, {"patent_id": patent_id, "assignee_sequence": assignee_sequence}))
+    return result.transpose().reset_index().rename(columns={"index": "field", 0: "value"})
 
-def get_engine():
-    user = CONFIG['user']
-    pswd = CONFIG['password']
-    hostname = CONFIG['hostname']
-    dbname = CONFIG['dbname']
-    engine = create_engine(f"mysql+pymysql://{user}:{pswd}@{hostname}/{dbname}?charset=utf8mb4")
-    return engine
+"""
+Parameters
+----------
+assignee_IDs : list of str
+    Disambiguated assignee IDs to extract
+chunksize : int
+    Number of rows read at a time from the snapshot or fetched at a time from MySQL
 
-def run_extraction(assignee_IDs=["160cad21-ac45-48a2-86db-3c935d5e53ce"], output_path=None, simplified=True):
+Returns
+-------
+Iterator over Pandas Dataframes with the extraction columns, read from the local snapshot when one exists and
+otherwise streamed from the rawassignee_for_hand_labeling view
+"""
+def extraction_chunks(assignee_IDs, chunksize=STREAM_CHUNKSIZE):
+    if snapshot_available(SNAPSHOT_DIR):
+        for chunk in snapshot_assignee_chunks(assignee_IDs, SNAPSHOT_DIR, chunksize):
+            yield format_extraction(chunk)
+        return
     engine = get_engine()
-    assignee_IDs_SQL = ', '.join("'" + item + "'" for item in assignee_IDs)
     with engine.connect() as connection:
-        query = f"SELECT * FROM rawassignee_for_hand_labeling r WHERE r.assignee IN ({assignee_IDs_SQL})"
-        result = connection.execute(text(query)).fetchall()
+        for chunk in stream_where_in(connection, "rawassignee_for_hand_labeling", "assignee", assignee_IDs, chunksize):
+            yield format_extraction(chunk)
 
-    df = pd.DataFrame(result)
-    df['assignee_type'] = df['assignee_type'].apply(lambda x: convert_assignee_type(x))
-    df = df[['patent_id', 'assignee_sequence', 'patent_title', 'patent_abstract', 'patent_date', 'patent_type',\
-        'assignee', 'assignee_type', 'assignee_individual_name_first', 'asassignee_individual_name_last',\
-        'assignee_organization', 'assignee_city', 'assignee_state', 'assignee_country']]
-    df.to_csv(output_path)
+def format_extraction(df):
+    return normalize_columns(df[EXTRACTION_COLS])
+
+"""
+Renumbers the index of `chunks` so the row numbers run on across chunks, as in a single dataframe
+"""
+def numbered_chunks(chunks):
+    row_count = 0
+    for chunk in chunks:
+        chunk.index = range(row_count, row_count + len(chunk.index))
+        row_count += len(chunk.index)
+        yield chunk
+
+"""
+Write extraction chunks to `output` (a file path or a binary buffer) one chunk at a time, either as CSV or through
+excel_export (xlsxwriter in constant memory mode) for XLSX
+"""
+def write_extraction(chunks, output, file_format):
+    if file_format == "csv":
+        file = open(output, "w", newline="", encoding="utf-8") if isinstance(output, str) \
+            else io.TextIOWrapper(output, encoding="utf-8", newline="", write_through=True)
+        for chunk in numbered_chunks(chunks):
+            chunk.to_csv(file, header=(chunk.index.start == 0))
+        if isinstance(output, str):
+            file.close()
+        else:
+            file.detach()
+    elif file_format == "xlsx":
+        write_excel_chunks(numbered_chunks(chunks), output, index=True)
+    elif file_format == "parquet":
+        write_parquet_chunks(chunks, output)
+    else:
+        raise ValueError(f"Unsupported extraction format: {file_format}")
+
+"""
+Parameters
+----------
+assignee_IDs : list of str
+    Disambiguated assignee IDs to extract
+output_path : str or binary file-like object
+    Output file path, or a buffer such as io.BytesIO to get the output without writing a file
+simplified : Boolean
+    Kept for compatibility with extraction_old.run_extraction(), the view only has simplified fields
+file_format : str
+    "csv", "xlsx" or "parquet". Defaults to the extension of `output_path`.
+"""
+def run_extraction(assignee_IDs=["160cad21-ac45-48a2-86db-3c935d5e53ce"], output_path=None, simplified=True,
+                   file_format=None):
+    file_format = file_format or os.path.splitext(output_path)[1][1:]
+    write_extraction(extraction_chunks(assignee_IDs), output_path, file_format)
 
 if __name__ == "__main__":
     disamb_IDs = np.loadtxt('data/05 - extraction/US8084741-0.txt', dtype="str").tolist()
@@ -4,8 +4,11 @@ import os
 import requests
 import json
 import time
-from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+import asyncio
+import sys
+import httpx
+from excel_export import write_excel
+from storage import write_table
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -28,6 +31,20 @@ ASSIGNEE_TYPE_DICT = { # Dictionary for converting assignee type into it's actua
     9: "U.S. state government"
 }
 PATENT_FIELDS = ["patent_id", "patent_title", "patent_abstract", "patent_date", "patent_type"]
+API_RATE_LIMIT = 45 # Requests per minute allowed for each API key
+MAX_CONNECTIONS = 10
+CPC_CACHE_PATH = "data/cpc_subclass_titles.json"
+CPC_CACHE_VERSION = 1
+CPC_SUBCLASS_DICT = None # Loaded on first use by get_cpc_subclass_dict()
+
+"""
+Seconds to wait before retrying a request, from the Retry-After header (sent as a string) of a 429 response
+"""
+def retry_after(response, default=60):
+    try:
+        return max(float(response.headers.get('Retry-After', default)), 0)
+    except ValueError:
+        return default
 
 """
 Download all CPC subclass titles from API and create a lookup dictionary
@@ -43,7 +60,7 @@ def cpc_subclass_dict():
 
         # Check for errors
         if response.status_code == 429:
-            wait_for = response.headers['Retry-After']
+            wait_for = retry_after(response)
             time.sleep(wait_for)
             continue
         if response.status_code != 200:
@@ -60,7 +77,36 @@ def cpc_subclass_dict():
             break
     return {item['cpc_subclass_id']: item['cpc_subclass_title'] for item in responses}
 
-CPC_SUBCLASS_DICT = cpc_subclass_dict()
+"""
+Parameters
+----------
+refresh : Boolean
+    If true, download the CPC subclass titles again and overwrite the on-disk cache
+cache_path : str
+    JSON file caching the CPC subclass titles along with the cache version and download date
+
+Returns
+-------
+Dictionary from CPC subclass ID to title. It is loaded from `cache_path` the first time it is needed (downloading it
+only when the cache is missing or from an older version) and kept in memory afterwards.
+"""
+def get_cpc_subclass_dict(refresh=False, cache_path=CPC_CACHE_PATH):
+    global CPC_SUBCLASS_DICT
+    if CPC_SUBCLASS_DICT is not None and not refresh:
+        return CPC_SUBCLASS_DICT
+
+    cache = None
+    if os.path.exists(cache_path) and not refresh:
+        with open(cache_path, "r") as file:
+            cache = json.load(file)
+    if cache is None or cache.get('version') != CPC_CACHE_VERSION:
+        cache = {'version': CPC_CACHE_VERSION, 'downloaded': time.strftime("%Y-%m-%d"), 'titles': cpc_subclass_dict()}
+        with open(cache_path + ".tmp", "w") as file:
+            json.dump(cache, file)
+        os.replace(cache_path + ".tmp", cache_path)
+
+    CPC_SUBCLASS_DICT = cache['titles']
+    return CPC_SUBCLASS_DICT
 
 """
 Simple extraction for single mention_id from the PV API with the following fields:
@@ -128,7 +174,7 @@ def full_extraction_output(assignee_IDs, simplified):
 
         # Check for errors
         if response.status_code == 429:
-            wait_for = int(response.headers['Retry-After'])
+            wait_for = retry_after(response)
             print(wait_for)
             time.sleep(wait_for)
             continue
@@ -146,6 +192,113 @@ def full_extraction_output(assignee_IDs, simplified):
             break 
     return full_output
 
+"""
+Token bucket shared by every concurrent request to the PV API. Tokens refill at `rate` per second up to `capacity`,
+and a 429 response pauses every request until its Retry-After delay has passed.
+"""
+class TokenBucket:
+    def __init__(self, rate=API_RATE_LIMIT / 60, capacity=API_RATE_LIMIT):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.resume_at = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait_for = max(self.resume_at - now, (1 - self.tokens) / self.rate)
+                if wait_for <= 0:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep(wait_for)
+
+    def pause(self, seconds):
+        self.tokens = 0
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+"""
+Send one request to the PV API through `client`, waiting for a token from `bucket` and retrying after 429 responses
+"""
+async def api_request(client, bucket, method, endpoint, **kwargs):
+    while True:
+        await bucket.acquire()
+        response = await client.request(method, f"{BASE_URL}/{endpoint.strip('/')}", **kwargs)
+        if response.status_code == TIMEOUT_CODE:
+            bucket.pause(retry_after(response))
+            continue
+        if response.status_code != ERROR_CODE:
+            raise Exception(response.headers)
+        return response.json()
+
+"""
+Asynchronous version of full_extraction_output(). Pages are requested one after the other since each page starts
+after the last patent of the previous one.
+"""
+async def full_extraction_output_async(client, bucket, assignee_IDs, simplified):
+    f_list = PATENT_FIELDS + ["assignees.*"]
+    if not simplified:
+        f_list += ["inventors.*", "cpc_current.*"]
+
+    full_output = []
+    param_dict = {
+        "f" : f_list,
+        "o" : {"size":1000},
+        "q" : {"assignees.assignee_id": assignee_IDs},
+        "s" : [{"patent_id":"asc"}],
+    }
+
+    while True:
+        response_data = await api_request(client, bucket, "POST", 'api/v1/patent', json=param_dict)
+        full_output += response_data['patents']
+        expected = response_data['total_hits']
+        if (response_data['count'] == 0) or (len(full_output) >= expected):
+            break
+        param_dict["o"]['after'] = response_data['patents'][-1]['patent_id']
+    return full_output
+
+"""
+Parameters
+----------
+clusters : dict
+    Mapping from a seed mention ID to the list of disambiguated assignee IDs to extract for it
+simplified : Boolean
+    If false, also extract inventors and CPC fields
+
+Returns
+-------
+Dictionary from each seed mention ID to its raw extraction output. Clusters are extracted concurrently over pooled
+keep-alive connections, with a shared token bucket keeping the total request rate under the API quota.
+"""
+async def full_extraction_outputs_async(clusters, simplified):
+    bucket = TokenBucket()
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+    headers = {"X-Api-Key": API_KEY}
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=60) as client:
+        outputs = await asyncio.gather(*[full_extraction_output_async(client, bucket, assignee_IDs, simplified)
+                                         for assignee_IDs in clusters.values()])
+    return dict(zip(clusters.keys(), outputs))
+
+"""
+Bulk version of run_extraction() for many seed mentions at once, saving `<seed mention ID><extension>` files in
+`output_dir` for every entry of `clusters`
+"""
+def run_extractions(clusters, output_dir="data/05 - extraction/", simplified=True, extension=".csv"):
+    dirty_outputs = asyncio.run(full_extraction_outputs_async(clusters, simplified))
+    for mention_id, dirty_output in dirty_outputs.items():
+        clean_output = process_extraction_output(dirty_output, clusters[mention_id], simplified)
+        output_path = os.path.join(output_dir, mention_id + extension)
+        if extension == ".csv":
+            extraction_output_to_csv(clean_output, simplified, output_path)
+        elif extension == ".xlsx":
+            extraction_output_to_excel(clean_output, simplified, output_path)
+        elif extension == ".parquet":
+            extraction_output_to_parquet(clean_output, simplified, output_path)
+
 def new_assignees(row, assignee_IDs, assignee_sequence=None):
     if 'assignees' in row.keys():
         new_assignees = []
@@ -181,7 +334,7 @@ def new_cpc(row):
             subclass_id = cpc['cpc_subclass_id']
             if subclass_id not in subclasses_observed:
                 subclasses_observed.add(subclass_id)
-                new_cpc.append({'cpc_section': subclass_id[0], 'cpc_subclass_id': subclass_id, 'cpc_subclass_title': CPC_SUBCLASS_DICT[subclass_id]})
+                new_cpc.append({'cpc_section': subclass_id[0], 'cpc_subclass_id': subclass_id, 'cpc_subclass_title': get_cpc_subclass_dict().get(subclass_id, '')})
         return new_cpc
     else:
         return [{'cpc_section': '', 'cpc_subclass_id': '', 'cpc_subclass_title': ''}]
@@ -207,76 +360,119 @@ def process_extraction_output(dirty_output, assignee_IDs, simplified):
     return clean_output
 
 
-def add_empty_rows(df, max_rows):
-    num_empty_rows = max_rows - len(df)
-    empty_rows = pd.DataFrame([{}]*num_empty_rows, columns=df.columns)
-    return pd.concat([df, empty_rows], ignore_index=True)
+"""
+Parameters
+----------
+output : list of dict
+    Clean extraction output from process_extraction_output()
+field : str
+    Nested list field to explode, either 'inventors' or 'cpc_current'
+sort_col : str
+    Column used to order the rows of each record
+
+Returns
+-------
+Pandas Dataframe with one row per element of `field` across all records, along with the `record` index of the
+result it belongs to and its `row_no` within that record. Integer columns (such as `inventor_sequence`) are nullable
+Int64, so padding rows of the layout leave them empty instead of turning them into floats.
+"""
+def explode_endpoint(output, field, sort_col):
+    exploded = pd.Series([result[field] for result in output], dtype=object).explode().dropna()
+    df = pd.DataFrame(exploded.tolist(), index=exploded.index).rename_axis('record').reset_index()
+    int_cols = [col for col in df.columns if col != 'record' and pd.api.types.is_integer_dtype(df[col])]
+    df[int_cols] = df[int_cols].astype('Int64')
+    df = df.sort_values(['record', sort_col], kind='stable')
+    df['row_no'] = df.groupby('record').cumcount()
+    return df
 
-def partition_endpoints(result):
-    # Create separate dataframes
-    inventors = pd.DataFrame.from_dict(result['inventors']).sort_values('inventor_sequence')
-    cpc = pd.DataFrame.from_dict(result['cpc_current']).sort_values('cpc_subclass_id')
+"""
+Builds the "side-by-side" layout of complex extractions for all records at once: each record spans as many rows as
+its longest endpoint (inventors or CPC subclasses), with patent and assignee fields repeated on every row and
+inventors and CPC subclasses aligned on (record, row_no).
 
-    # Add empty rows
-    row_count = max(len(inventors.index), len(cpc.index))
-    inventors = add_empty_rows(inventors, row_count)
-    cpc = add_empty_rows(cpc, row_count)
-    
-    return inventors, cpc
+Returns
+-------
+Pandas Dataframe indexed by the row number within each record
+"""
+def complex_layout(output):
+    records = pd.DataFrame.from_records([{field: value for field, value in result.items()
+                                          if field not in ('inventors', 'cpc_current')} for result in output])
+    records['record'] = range(len(records.index))
+    inventors = explode_endpoint(output, 'inventors', 'inventor_sequence')
+    cpc = explode_endpoint(output, 'cpc_current', 'cpc_subclass_id')
+
+    # Number of rows needed by each record, and the (record, row_no) grid they span
+    row_counts = pd.concat([inventors.groupby('record').size(), cpc.groupby('record').size()], axis=1)\
+        .max(axis=1).reindex(records['record'], fill_value=1).clip(lower=1)
+    rows = pd.DataFrame({'record': np.repeat(row_counts.index.to_numpy(), row_counts.to_numpy())})
+    rows['row_no'] = rows.groupby('record').cumcount()
+
+    # Align everything on the grid
+    layout = rows.merge(records, on='record', how='left')\
+        .merge(inventors, on=['record', 'row_no'], how='left')\
+        .merge(cpc, on=['record', 'row_no'], how='left')
+    return layout.set_index('row_no').rename_axis(None).drop(columns='record')
 
 def extraction_output_to_csv(output, simplified, output_path="data/05 - extraction/output.csv"):
     if simplified:
         pd.DataFrame.from_dict(output).to_csv(output_path)
     else:
-        df_list = []
-
-        for result in output:
-            # Separating data to add empty rows where necessary
-            inventors, cpc = partition_endpoints(result)
-            del result['inventors']
-            del result['cpc_current']
-            patent_df = pd.DataFrame.from_dict([result] * max(len(inventors.index), len(cpc.index)))
+        complex_layout(output).to_csv(output_path)
 
-            # Combining and storing result
-            result = pd.concat([patent_df, inventors, cpc], axis=1)
-            df_list.append(result)
-            
-        pd.concat(df_list).to_csv(output_path)
+def extraction_output_to_parquet(output, simplified, output_path="data/05 - extraction/output.parquet"):
+    if simplified:
+        write_table(pd.DataFrame.from_dict(output), output_path, file_format="parquet")
+    else:
+        write_table(complex_layout(output), output_path, file_format="parquet")
 
 def extraction_output_to_excel(output, simplified, output_path="data/05 - extraction/output.xlsx"):
     if simplified:
-        pd.DataFrame.from_dict(output).to_excel(output_path)
+        write_excel(pd.DataFrame.from_dict(output), output_path, index=True) # Same columns as the CSV output
     else:
-        wb = Workbook()
-        ws = wb.active
-
-        for result in output:
-            # Separating data to add empty rows where necessary
-            inventors, cpc = partition_endpoints(result)
-            del result['inventors']
-            del result['cpc_current']
-            patent = {field: result[field] for field in PATENT_FIELDS}
-            patent_df = pd.DataFrame.from_dict([patent] * max(len(inventors.index), len(cpc.index), len(assignees.index)))
-
-            # Combining and storing result
-            result = pd.concat([patent_df, assignees, inventors, cpc], axis=1)
-            merge_start = ws.max_row + 1
-            merge_end = merge_start + len(result.index) - 1
-            for row in dataframe_to_rows(result, index=False, header=(merge_start == 2)):
-                ws.append(row)
-            for col in range(1, 6):
-                ws.merge_cells(start_row=merge_start, end_row=merge_end, start_column=col, end_column=col)
-
-        wb.save(output_path)
-
-def run_extraction(assignee_IDs=["a0ba1f5c-6e5f-4f62-b309-22bd81c8b043"], output_path=None, simplified=True):
+        # Patent and assignee fields are merged across the rows of each record
+        layout = complex_layout(output)
+        record_starts = np.flatnonzero(layout.index == 0)
+        group_sizes = np.diff(np.append(record_starts, len(layout.index)))
+        merge_columns = list(dict.fromkeys(field for result in output for field in result
+                                           if field not in ('inventors', 'cpc_current')))
+        write_excel(layout, output_path, merge_columns, group_sizes)
+
+"""
+`output_path` can be a file path or a binary buffer such as io.BytesIO, in which case `file_format` ("csv", "xlsx"
+or "parquet") must be given
+"""
+def run_extraction(assignee_IDs=["a0ba1f5c-6e5f-4f62-b309-22bd81c8b043"], output_path=None, simplified=True,
+                   file_format=None):
+    file_format = file_format or os.path.splitext(output_path)[1][1:]
     dirty_output = full_extraction_output(assignee_IDs, simplified)
     clean_output = process_extraction_output(dirty_output, assignee_IDs, simplified)
-    if output_path[-4:] == ".csv":
+    if file_format == "csv":
         extraction_output_to_csv(clean_output, simplified, output_path)
-    elif output_path[-5:] == ".xlsx":
+    elif file_format == "xlsx":
         extraction_output_to_excel(clean_output, simplified, output_path)
+    elif file_format == "parquet":
+        extraction_output_to_parquet(clean_output, simplified, output_path)
+
+"""
+Parameters
+----------
+paths : list of str
+    Text files named "<seed mention ID>.txt" listing one disambiguated assignee ID per line, such as
+    "data/05 - extraction/US5031150-0.txt"
+
+Returns
+-------
+Dictionary from each seed mention ID to its assignee IDs, as expected by run_extractions()
+"""
+def read_clusters(paths):
+    return {os.path.splitext(os.path.basename(path))[0]: np.loadtxt(path, dtype="str", ndmin=1).tolist() for path in paths}
 
 if __name__ == "__main__":
-    disamb_IDs = np.loadtxt('data/05 - extraction/US5031150-0.txt', dtype="str").tolist()
-    obj = run_extraction(assignee_IDs=disamb_IDs, output_path="data/05 - extraction/US5031150-0.csv", simplified=True)
\ No newline at end of file
+    # Usage: python extraction_old.py [--complex] [--xlsx | --parquet] [<seed mention ID>.txt ...]
+    # Extracts every cluster file given (by default every .txt file of data/05 - extraction/) concurrently, saving
+    # "<seed mention ID>.csv" (or .xlsx, .parquet) in the folder of the first file
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    extension = ".xlsx" if "--xlsx" in sys.argv else ".parquet" if "--parquet" in sys.argv else ".csv"
+    output_dir = os.path.dirname(args[0]) if len(args) > 0 else "data/05 - extraction/"
+    paths = args or [os.path.join(output_dir, file) for file in sorted(os.listdir(output_dir)) if file.endswith(".txt")]
+    run_extractions(read_clusters(paths), output_dir, simplified="--complex" not in sys.argv, extension=extension)
\ No newline at end of file
@@ -0,0 +1,103 @@
+import unicodedata
+import re
+
+CORPORATE_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "cos", "companies", "ltd", "limited", "llc", "llp",
+    "lp", "plc", "gmbh", "mbh", "ag", "kg", "sa", "sas", "sarl", "srl", "spa", "bv", "nv", "ab", "as", "asa", "oy",
+    "oyj", "kk", "kabushiki", "kaisha", "pty", "pte", "se",
+}
+LEADING_WORDS = {"the"}
+MIN_ACRONYM_LENGTH = 3 # Shorter acronyms ("sg", "at") match too many unrelated names
+SOUNDEX_CODES = {**dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"), **dict.fromkeys("dt", "3"), "l": "4",
+                 **dict.fromkeys("mn", "5"), "r": "6"}
+PUNCTUATION = re.compile(r"[^\w\s]")
+SPACES = re.compile(r"\s+")
+
+
+"""
+Lower-cases `name`, removes diacritics ("Société" -> "societe") and replaces punctuation by spaces, so that
+"S.A." and "SA" or "Müller" and "Muller" become the same string
+"""
+def fold(name):
+    decomposed = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+    name = PUNCTUATION.sub(" ", name.replace(".", "").replace("'", ""))
+    return SPACES.sub(" ", name).strip()
+
+
+"""
+Removes trailing corporate suffixes ("Acme Widgets Co., Ltd." -> "acme widgets") and leading articles from a
+folded name, keeping at least one token
+"""
+def strip_suffixes(folded):
+    tokens = folded.split()
+    while len(tokens) > 1 and tokens[-1] in CORPORATE_SUFFIXES:
+        tokens.pop()
+    while len(tokens) > 1 and tokens[0] in LEADING_WORDS:
+        tokens.pop(0)
+    return " ".join(tokens)
+
+
+"""
+Initials of a stripped name of several tokens ("international business machines" -> "ibm"), or None
+"""
+def acronym(stripped):
+    tokens = [token for token in stripped.split() if token not in {"and", "of", "for"}]
+    if len(tokens) < 2:
+        return None
+    return "".join(token[0] for token in tokens)
+
+
+"""
+Soundex code of a folded token ("microsoft" and "micrsoft" -> "m262"), so that names spelled differently but
+pronounced alike share a code. Digits are kept as is ("3m" -> "3m").
+"""
+def soundex(token):
+    if not token.isalpha():
+        return token
+    code = token[0]
+    previous = SOUNDEX_CODES.get(token[0], "")
+    for char in token[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+        if char not in "hw":
+            previous = digit
+    return (code + "000")[:4]
+
+
+"""
+Acronym variant of organization `name` ("International Business Machines Corp." -> "ibm"), or None if it is shorter
+than MIN_ACRONYM_LENGTH. Acronyms should be searched without fuzziness, which would match almost any short token.
+"""
+def name_acronym(name):
+    initials = acronym(strip_suffixes(fold(name)))
+    return initials if initials is not None and len(initials) >= MIN_ACRONYM_LENGTH else None
+
+
+"""
+Parameters
+----------
+name : str
+    Organization or individual name, such as the seed mention's organization
+individual : Boolean
+    Whether `name` is an individual's name, which is also searched in "Last, First" / "First Last" order
+
+Returns
+-------
+List of distinct search strings for `name`, the original first: folded name, name without corporate suffixes, and
+the acronym of organizations (see name_acronym()) or the reordered tokens of individuals (match queries ignore token order, so reordering
+only matters for individuals, whose tokens are also searched in the other name field)
+"""
+def name_variants(name, individual=False):
+    folded = fold(name)
+    stripped = strip_suffixes(folded)
+    variants = [name, folded, stripped]
+    if individual:
+        if "," in name:
+            last, first = name.split(",", 1)
+            variants.append(f"{first.strip()} {last.strip()}")
+        variants.append(" ".join(reversed(stripped.split())))
+    else:
+        variants.append(name_acronym(name))
+    return [variant for variant in dict.fromkeys(variants) if variant]
@@ -0,0 +1,29 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+
+"""
+Parameters
+----------
+function : callable
+    Module-level function (or functools.partial of one) applied to every item, so it can be sent to worker processes
+items : list
+    Arguments of `function`, each sent to a worker process
+min_items : int
+    Smallest number of items worth starting worker processes for. Shorter lists are mapped in this process, which is
+    faster than starting the pool.
+workers : int
+    Number of processes, defaults to the number of CPUs
+
+Returns
+-------
+Iterator over `function(item)` for every item, in the order of `items` whatever the order in which they complete.
+Items are sent to the workers in chunks, about four per worker, so that a slow chunk does not hold the others back.
+"""
+def parallel_map(function, items, min_items=1, workers=None):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(items) < min_items:
+        yield from map(function, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(function, items, chunksize=max(1, len(items) // (4 * workers)))
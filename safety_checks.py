@@ -1,112 +1,376 @@
 import os
+import sys
 import pandas as pd
-import pickle
+import sqlite3
+import hashlib
+import time
+import itertools
+from parallel import parallel_map
+import functools
 from tqdm import tqdm
 import numpy as np
-<<<<<<< Updated upstream
-
-LOG_FP = "data/error_log.txt"
-def log(filename, new_line):
-    try:
-        # Open the file in append mode
-        with open(filename, 'a') as file:
-            file.write(new_line + '\n')
-    except Exception as e:
-        log(LOG_FP, f"ERROR WHILE LOGGING: {e}")
-=======
 import json
+from storage import read_table
 
+DIRECTORY_PATH = "data/Week 2 Dropbox/"
+INDEX_PATH = "data/safety_checks_index.sqlite"
 LOG_FP = "data/error_log.csv"
+PARALLEL_MIN_FILES = 16
+LOG_COLS = ["message", "message_type", "file", "desc", "data"]
 ERROR_LOG = []
 def log(message, message_type, file, desc, data):
     try:
         ERROR_LOG.append({"message": message, "message_type": message_type, "file": file, "desc": desc, "data": data})
     except Exception as e:
         log("ERROR", "LOGGING", None, e, None)
->>>>>>> Stashed changes
 
-# Step 1: Get a list of CSV files in the given directory
-directory_path = "data/Week 2 Dropbox/"
-csv_files = [file for file in os.listdir(directory_path) if file.endswith(".csv")]
 
-# Step 2: Initialize the set variable all_patent_ids
-all_patent_ids = set()
-pickle_file_path = "data/all_patent_ids.pkl"
+"""
+Parameters
+----------
+index_path : str
+    Path to the SQLite index, created if it does not exist
 
-# Step 3: Loop through each CSV file, load it with pandas, and extract patent_id
-for csv_file in tqdm(csv_files, desc="Looping through files"):
-    try:
-<<<<<<< Updated upstream
-        file_path = os.path.join(directory_path, csv_file)
-        df = pd.read_csv(file_path, dtype={'patent_id': str, 'assignee_sequence': str})
-        patent_ids = set("US" + df['patent_id'] + "-" + df['assignee_sequence']) # Extract the patent_id column and add it to the all_patent_ids set
-        all_patent_ids.update(patent_ids)
-
-        # Get seed patent related info
-        seed_patent = csv_file[:-4]
-        patent_id = seed_patent[2:seed_patent.find('-')]
-        assignee_sequence = seed_patent[seed_patent.find('-')+1:]
-        seed_rows = df[np.logical_and(df['patent_id'] == patent_id, df['assignee_sequence'] == assignee_sequence)]
-        seed_info = seed_rows.iloc[0].to_dict()
-
-        # Ensure seed patent is contained in file
-        if len(seed_rows) == 0:
-            log(LOG_FP, f"CHECK: {csv_file} does not contain seed patent.")
-            continue
+Returns
+-------
+sqlite3 connection to the index, which has three tables:
+    - files: every checked file with the modification time, size and content hash it was checked at, and the order
+      in which it was first seen (earlier files own a mention ID when two files contain it)
+    - mentions: mention ID -> file containing it
+    - checks: problems found in each file, kept until the file changes
+"""
+def open_index(index_path=INDEX_PATH):
+    connection = sqlite3.connect(index_path)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, mtime REAL, size INTEGER, hash TEXT, first_seen INTEGER);
+        CREATE TABLE IF NOT EXISTS mentions (mention_id TEXT, file TEXT, PRIMARY KEY (mention_id, file)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS mentions_file ON mentions (file);
+        CREATE TABLE IF NOT EXISTS checks (file TEXT, message TEXT, message_type TEXT, desc TEXT, data TEXT);
+        CREATE INDEX IF NOT EXISTS checks_file ON checks (file);
+    """)
+    return connection
 
-        # Ensure organization/last_name first letter matches
-        key = "assignee_organization" if not pd.isna(seed_info['assignee_organization']) else "assignee_individual_name_first"
-        if not (df[key].str[0].str.lower() == seed_info['assignee_organization'][0].lower()).all():
-            log(LOG_FP, f"CHECK: {csv_file} {key} do not all start with the same character.")
-            continue
 
-    except Exception as e:
-        log(LOG_FP, f"ERROR WHILE CHECKING: {e}")
-=======
-        # Extract patent_ids from new file
-        file_path = os.path.join(directory_path, csv_file)
-        df = pd.read_csv(file_path, dtype={'patent_id': str, 'assignee_sequence': str})
-        patent_ids = set("US" + df['patent_id'] + "-" + df['assignee_sequence']) # Extract the patent_id column and add it to the all_patent_ids set
-        intersection = patent_ids.intersection(all_patent_ids)
-
-        # Ensure patent_ids have not been seen before by another disambiguation file
-        if len(patent_ids.intersection(all_patent_ids)) > 0: 
-            log("CHECK", "DUPLICATE", csv_file, "Contains one or more patent_id's which belong to another file", intersection)
-            continue
-        all_patent_ids.update(patent_ids)
-
-        # Get seed patent related info
-        seed_patent = csv_file[:-4]
-        patent_id = seed_patent[2:seed_patent.find('-')]
-        assignee_sequence = seed_patent[seed_patent.find('-')+1:]
-        seed_rows = df[np.logical_and(df['patent_id'] == patent_id, df['assignee_sequence'] == assignee_sequence)]
-        seed_info = seed_rows.iloc[0].to_dict()
-
-        # Ensure seed patent is contained in file
-        if len(seed_rows) == 0:
-            log("CHECK", "SEED", csv_file, "File does not contain seed patent", None)
+"""
+Returns the SHA-1 digest of the content of the file at `path`
+"""
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+"""
+Parameters
+----------
+connection : sqlite3 connection
+    Connection to the index, from open_index()
+directory_path : str
+    Folder of hand labeled files
+
+Returns
+-------
+List of (file, mtime, size, hash) for the files which are new or whose content changed since they were indexed.
+Files whose modification time changed but whose content did not only have their modification time updated, and files
+which no longer exist are removed from the index.
+"""
+def changed_files(connection, directory_path=DIRECTORY_PATH):
+    indexed = {file: (mtime, size, hash) for file, mtime, size, hash in connection.execute("SELECT file, mtime, size, hash FROM files")}
+    files = sorted(file for file in os.listdir(directory_path) if file.endswith((".csv", ".parquet")))
+
+    # Forget files that were deleted
+    for file in set(indexed) - set(files):
+        remove_file(connection, file)
+
+    changed = []
+    for file in files:
+        stat = os.stat(os.path.join(directory_path, file))
+        if file in indexed and indexed[file][:2] == (stat.st_mtime, stat.st_size):
             continue
-        
-        # Get info on the assignee type
-        key = "assignee_organization" if not pd.isna(seed_info['assignee_organization']) else "assignee_individual_name_first"
-        expected_first_letter = seed_info['assignee_organization'][0].lower()
-        actual_first_letters = df[key].str[0].str.lower()
-
-        # Ensure organization/last_name first letter matches
-        if not (actual_first_letters == expected_first_letter).all():
-            # Output message
-            expected_key = seed_info['assignee_organization']
-            wrong_keys = df[key][actual_first_letters != expected_first_letter].tolist()
-            log("CHECK", "FIRST CHAR", csv_file, f"{expected_key} is the {key} which has mismatching first characters", json.dumps(wrong_keys))
+        hash = file_hash(os.path.join(directory_path, file))
+        if file in indexed and indexed[file][2] == hash:
+            connection.execute("UPDATE files SET mtime = ? WHERE file = ?", (stat.st_mtime, file))
             continue
+        changed.append((file, stat.st_mtime, stat.st_size, hash))
+    connection.commit()
+    return changed
+
 
+def remove_file(connection, file):
+    connection.execute("DELETE FROM files WHERE file = ?", (file,))
+    connection.execute("DELETE FROM mentions WHERE file = ?", (file,))
+    connection.execute("DELETE FROM checks WHERE file = ?", (file,))
+
+
+"""
+Returns the set of mention IDs ("US<patent_id>-<assignee_sequence>") contained in a hand labeled file
+"""
+def file_mention_ids(df):
+    return set("US" + df['patent_id'] + "-" + df['assignee_sequence'])
+
+
+"""
+Parameters
+----------
+file : str
+    Name of the hand labeled file, "<seed mention ID>.csv"
+df : Pandas Dataframe
+    Content of the file, with `assignee_sequence` as strings
+
+Returns
+-------
+List of problems found in the file, in the format of `log()`:
+    - SEED: the seed mention is not in the file
+    - FIRST CHAR: organizations (or first names) do not all start with the same character as the seed's
+"""
+def check_file(file, df):
+    # Get seed patent related info
+    seed_patent = os.path.splitext(file)[0]
+    patent_id = seed_patent[2:seed_patent.find('-')]
+    assignee_sequence = seed_patent[seed_patent.find('-')+1:]
+    seed_rows = df[np.logical_and(df['patent_id'] == patent_id, df['assignee_sequence'] == assignee_sequence)]
+
+    # Ensure seed patent is contained in file
+    if len(seed_rows) == 0:
+        return [{"message": "CHECK", "message_type": "SEED", "file": file, "desc": "File does not contain seed patent", "data": None}]
+    seed_info = seed_rows.iloc[0].to_dict()
+
+    # Get info on the assignee type
+    key = "assignee_organization" if not pd.isna(seed_info['assignee_organization']) else "assignee_individual_name_first"
+    expected_first_letter = seed_info[key][0].lower()
+    actual_first_letters = df[key].str[0].str.lower()
+
+    # Ensure organization/last_name first letter matches
+    if not (actual_first_letters == expected_first_letter).all():
+        expected_key = seed_info[key]
+        wrong_keys = df[key][actual_first_letters != expected_first_letter].tolist()
+        return [{"message": "CHECK", "message_type": "FIRST CHAR", "file": file,
+                 "desc": f"{expected_key} is the {key} which has mismatching first characters", "data": json.dumps(wrong_keys)}]
+    return []
+
+
+"""
+Parameters
+----------
+directory_path : str
+    Folder of hand labeled files
+file : str
+    Name of the file to validate
+
+Returns
+-------
+Dictionary with the result of validating one file: its name, its set of mention IDs and the list of problems found
+by check_file(). Has no side effects, so files can be validated in separate processes.
+"""
+def validate_file(directory_path, file):
+    try:
+        df = read_table(os.path.join(directory_path, file)).astype({'assignee_sequence': str})
+        return {"file": file, "mention_ids": file_mention_ids(df), "checks": check_file(file, df)}
     except Exception as e:
-        log("ERROR", "CHECKING", csv_file, e, None)
->>>>>>> Stashed changes
+        return {"file": file, "mention_ids": set(),
+                "checks": [{"message": "ERROR", "message_type": "CHECKING", "file": file, "desc": str(e), "data": None}]}
+
+
+"""
+Parameters
+----------
+directory_path : str
+    Folder of hand labeled files
+files : list of str
+    Names of the files to validate
+workers : int
+    Number of processes, defaults to the number of CPUs. Fewer than PARALLEL_MIN_FILES files are validated in this
+    process.
+
+Returns
+-------
+Iterator over the results of validate_file(), in the order of `files` (see parallel.parallel_map())
+"""
+def validate_files(directory_path, files, workers=None):
+    return parallel_map(functools.partial(validate_file, directory_path), list(files), PARALLEL_MIN_FILES, workers)
+
+
+"""
+Parameters
+----------
+connection : sqlite3 connection
+    Connection to the index, from open_index()
+result : dict
+    Result of validate_file()
+mtime, size, hash :
+    State of the validated file, from changed_files()
+
+Output
+------
+Reduce step of the validation: replaces the mention IDs and problems of one file in the index
+"""
+def index_file(connection, result, mtime, size, hash):
+    file = result["file"]
+
+    # Keep the order the file was first seen in, which decides the owner of duplicated mention IDs
+    first_seen = connection.execute("SELECT first_seen FROM files WHERE file = ?", (file,)).fetchone()
+    if first_seen is None:
+        first_seen = connection.execute("SELECT COALESCE(MAX(first_seen), -1) + 1 FROM files").fetchone()
+    remove_file(connection, file)
+    connection.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?)", (file, mtime, size, hash, first_seen[0]))
+    connection.executemany("INSERT INTO mentions VALUES (?, ?)", [(mention_id, file) for mention_id in sorted(result["mention_ids"])])
+    connection.executemany("INSERT INTO checks VALUES (:file, :message, :message_type, :desc, :data)", result["checks"])
+
+
+"""
+Returns
+-------
+Dictionary from file name to the sorted mention IDs it shares with a file that was indexed before it
+"""
+def indexed_duplicates(connection):
+    rows = connection.execute("""
+        SELECT m.file, o.mention_id
+        FROM mentions o
+        JOIN mentions m ON m.mention_id = o.mention_id AND m.file != o.file
+        JOIN files fm ON fm.file = m.file
+        JOIN files fo ON fo.file = o.file
+        WHERE fo.first_seen < fm.first_seen
+    """).fetchall()
+    duplicates = {}
+    for file, mention_id in rows:
+        duplicates.setdefault(file, set()).add(mention_id)
+    return {file: sorted(mention_ids) for file, mention_ids in duplicates.items()}
+
+
+"""
+Returns the set of every mention ID in the index, replacing the former all_patent_ids pickle
+"""
+def all_mention_ids(index_path=INDEX_PATH):
+    connection = open_index(index_path)
+    mention_ids = {mention_id for mention_id, in connection.execute("SELECT DISTINCT mention_id FROM mentions")}
+    connection.close()
+    return mention_ids
+
+
+"""
+Parameters
+----------
+mention_ids : array-like of str
+    Mention ID of every labeled row
+files : array-like of str
+    File containing each row of `mention_ids`
+
+Returns
+-------
+Pandas Dataframe with one row for every mention ID contained in two different files, whatever the order in which the
+files were checked: `mention_id`, `file_1` and `file_2` (with `file_1` < `file_2`). Mention IDs and files are encoded
+as integers, sorted once and grouped in a single pass, so this takes O(N log N) time for N labeled rows.
+"""
+def conflict_pairs(mention_ids, files):
+    mention_codes, mention_values = pd.factorize(np.asarray(mention_ids, dtype=object))
+    file_codes, file_values = pd.factorize(np.asarray(files, dtype=object), sort=True)
+    mention_codes = mention_codes.astype(np.int32)
+    file_codes = file_codes.astype(np.int32)
+
+    # Sort by (mention, file) and drop rows repeated within a file
+    order = np.lexsort((file_codes, mention_codes))
+    mention_codes, file_codes = mention_codes[order], file_codes[order]
+    distinct = np.ones(len(mention_codes), dtype=bool)
+    distinct[1:] = (mention_codes[1:] != mention_codes[:-1]) | (file_codes[1:] != file_codes[:-1])
+    mention_codes, file_codes = mention_codes[distinct], file_codes[distinct]
+
+    # Groups of consecutive rows with the same mention ID, only those spanning several files conflict
+    starts = np.flatnonzero(np.r_[True, mention_codes[1:] != mention_codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(mention_codes)])
+    pairs = []
+    for size in np.unique(sizes[sizes > 1]):
+        # Every pair of files within groups of the same size, as columns of a (groups x size) matrix
+        group_starts = starts[sizes == size]
+        group_files = file_codes[group_starts[:, None] + np.arange(size)]
+        for i, j in itertools.combinations(range(size), 2):
+            pairs.append(pd.DataFrame({"mention_id": mention_values[mention_codes[group_starts]],
+                                       "file_1": file_values[group_files[:, i]], "file_2": file_values[group_files[:, j]]}))
+    if len(pairs) == 0:
+        return pd.DataFrame(columns=["mention_id", "file_1", "file_2"])
+    return pd.concat(pairs, ignore_index=True).sort_values(["file_1", "file_2", "mention_id"], ignore_index=True)
+
+
+"""
+Returns a symmetric file x file Pandas Dataframe with the number of mention IDs shared by each pair of files in
+`pairs` (from conflict_pairs()), restricted to files with at least one conflict
+"""
+def conflict_matrix(pairs):
+    counts = pd.concat([pairs[["file_1", "file_2"]], pairs[["file_2", "file_1"]].set_axis(["file_1", "file_2"], axis=1)],
+                       ignore_index=True)
+    return pd.crosstab(counts["file_1"], counts["file_2"]).rename_axis(index=None, columns=None)
+
+
+"""
+Parameters
+----------
+index_path : str
+    Path to the persistent SQLite index
+output_dir : str
+    Folder for `duplicate_pairs.csv` (one row per conflicting mention ID and pair of files) and
+    `duplicate_matrix.csv` (number of shared mention IDs for every pair of conflicting files)
+
+Output
+------
+Global duplicate detection over every (mention ID, file) row of the index
+"""
+def duplicate_report(index_path=INDEX_PATH, output_dir="data/"):
+    connection = open_index(index_path)
+    rows = pd.read_sql_query("SELECT mention_id, file FROM mentions", connection)
+    connection.close()
+
+    pairs = conflict_pairs(rows["mention_id"].to_numpy(), rows["file"].to_numpy())
+    pairs.to_csv(os.path.join(output_dir, "duplicate_pairs.csv"), index=False)
+    conflict_matrix(pairs).to_csv(os.path.join(output_dir, "duplicate_matrix.csv"))
+    print(f"Found {pairs['mention_id'].nunique()} mention IDs shared by {len(pairs[['file_1', 'file_2']].drop_duplicates().index)} pairs of files")
+
+
+"""
+Parameters
+----------
+directory_path : str
+    Folder of hand labeled files
+index_path : str
+    Path to the persistent SQLite index
+log_path : str
+    Path to the CSV error log
+workers : int
+    Number of processes used to validate files
+global_duplicates : Boolean
+    Also run duplicate_report() over the updated index
+
+Output
+------
+Validates the hand labeled files which are new or changed since the previous run, then writes the error log with the
+problems of every file in the folder, including mention IDs which already belong to another file
+"""
+def main(directory_path=DIRECTORY_PATH, index_path=INDEX_PATH, log_path=LOG_FP, workers=None, global_duplicates=False):
+    start = time.perf_counter()
+    connection = open_index(index_path)
+    changed = changed_files(connection, directory_path)
+
+    # Only re-validate new or changed files, in parallel, and merge the results in file order so that new files are
+    # always first seen in the same order
+    results = validate_files(directory_path, [file for file, mtime, size, hash in changed], workers)
+    for (file, mtime, size, hash), result in tqdm(zip(changed, results), total=len(changed), desc="Checking new or changed files"):
+        index_file(connection, result, mtime, size, hash)
+        connection.commit()
+
+    # Report stored problems and duplicates against the whole index
+    ERROR_LOG.clear()
+    for row in connection.execute("SELECT file, message, message_type, desc, data FROM checks ORDER BY file"):
+        log(row[1], row[2], row[0], row[3], row[4])
+    for file, mention_ids in indexed_duplicates(connection).items():
+        log("CHECK", "DUPLICATE", file, "Contains one or more patent_id's which belong to another file", json.dumps(mention_ids))
+    connection.close()
 
-# Step 4: Save the all_patent_ids set to the pickle file
-with open(pickle_file_path, 'wb') as pickle_file:
-    pickle.dump(all_patent_ids, pickle_file)
+    # Save error log
+    pd.DataFrame(ERROR_LOG, columns=LOG_COLS).to_csv(log_path)
+    print(f"Checked {len(changed)} new or changed files in {time.perf_counter() - start:.2f}s, {len(ERROR_LOG)} problems logged")
+    if global_duplicates:
+        duplicate_report(index_path, os.path.dirname(log_path))
 
-# Step 5: Save error log
-pd.DataFrame(ERROR_LOG).to_csv(LOG_FP)
\ No newline at end of file
+if __name__ == "__main__":
+    # python safety_checks.py --global also writes the conflict matrix of every pair of files
+    main(global_duplicates="--global" in sys.argv[1:])
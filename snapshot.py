@@ -0,0 +1,209 @@
+from dotenv import dotenv_values
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pandas as pd
+import functools
+import datetime
+import shutil
+import json
+import os
+
+SNAPSHOT_DIR = dotenv_values(".env").get("snapshot_dir", "data/rawassignee_snapshot/") # Shared by every reader
+SNAPSHOT_META = "_snapshot.json"
+MENTION_INDEX = "_mentions.parquet"
+MENTION_INDEX_ROW_GROUP = 5_000 # Rows of the sorted mention index read by a lookup
+SNAPSHOT_ROW_GROUP = 5_000 # Rows of the snapshot read by a mention lookup
+SNAPSHOT_VIEW = "rawassignee_for_hand_labeling"
+PARTITION_COL = "assignee_prefix"
+INTEGER_COLS = ["assignee_sequence", "assignee_type"]
+
+
+"""
+Parameters
+----------
+chunk : Pandas Dataframe
+    Rows of the rawassignee_for_hand_labeling view
+
+Returns
+-------
+pyarrow Table with a fixed schema, so every chunk of the export writes compatible Parquet files:
+integer columns are nullable int64, every other column is stored as a string.
+Also adds the `assignee_prefix` partition column (first character of the disambiguated assignee ID).
+"""
+def snapshot_table(chunk):
+    arrays = {}
+    for column in chunk.columns:
+        if column in INTEGER_COLS:
+            arrays[column] = pa.array(pd.to_numeric(chunk[column], errors="coerce"), type=pa.int64(), from_pandas=True)
+        else:
+            values = chunk[column].astype(object).where(chunk[column].notna(), None)
+            arrays[column] = pa.array([None if value is None else str(value) for value in values], type=pa.string())
+    arrays[PARTITION_COL] = pa.array(chunk["assignee"].fillna("_").astype(str).str[0].str.lower(), type=pa.string())
+    return pa.table(arrays)
+
+
+"""
+Parameters
+----------
+engine : sqlalchemy.engine.Engine
+    Engine connected to the PV database
+output_dir : str
+    Folder for the Parquet snapshot, partitioned by `assignee_prefix`
+chunksize : int
+    Number of rows fetched and written at a time
+
+Output
+------
+Exports the whole rawassignee_for_hand_labeling view to `output_dir`, with the mention index of
+write_mention_index(). The export is written to a temporary folder and only replaces the previous snapshot once it is
+complete.
+"""
+def export_snapshot(engine, output_dir=SNAPSHOT_DIR, chunksize=100_000):
+    temp_dir = output_dir.rstrip("/") + ".tmp"
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
+
+    # Stream the view with a server-side cursor and write each chunk as its own set of Parquet files
+    row_count = 0
+    with engine.connect().execution_options(stream_results=True) as connection:
+        chunks = pd.read_sql(f"SELECT * FROM {SNAPSHOT_VIEW}", connection, chunksize=chunksize)
+        for i, chunk in enumerate(chunks):
+            table = snapshot_table(chunk.sort_values(["patent_id", "assignee_sequence"]))
+            pq.write_to_dataset(table, temp_dir, partition_cols=[PARTITION_COL], basename_template=f"part-{i:05d}-{{i}}.parquet",
+                                row_group_size=SNAPSHOT_ROW_GROUP)
+            row_count += table.num_rows
+            print("Exported", row_count, "rows")
+
+    # Index mentions, record snapshot information and swap it in place
+    write_mention_index(temp_dir)
+    meta = {"view": SNAPSHOT_VIEW, "created": datetime.datetime.now().isoformat(timespec="seconds"), "rows": row_count}
+    with open(os.path.join(temp_dir, SNAPSHOT_META), "w") as file:
+        json.dump(meta, file)
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(temp_dir, output_dir.rstrip("/"))
+
+
+"""
+Parameters
+----------
+snapshot_dir : str
+    Folder of the Parquet snapshot
+
+Output
+------
+Writes the mention index of the snapshot: the `patent_id` and `assignee_sequence` of every row with the part file and
+row group holding it, sorted by `patent_id` in row groups of MENTION_INDEX_ROW_GROUP rows. The snapshot is partitioned by
+assignee, so a lookup by mention could not prune any part file without it.
+"""
+def write_mention_index(snapshot_dir):
+    tables = []
+    for path in ds.dataset(snapshot_dir, format="parquet", partitioning="hive", exclude_invalid_files=True).files:
+        part = pq.ParquetFile(path)
+        for row_group in range(part.num_row_groups):
+            table = part.read_row_group(row_group, columns=["patent_id", "assignee_sequence"])
+            tables.append(table.append_column("path", pa.array([os.path.relpath(path, snapshot_dir)] * table.num_rows))
+                               .append_column("row_group", pa.array([row_group] * table.num_rows, type=pa.int32())))
+    index = pa.concat_tables(tables).sort_by("patent_id")
+    pq.write_table(index, os.path.join(snapshot_dir, MENTION_INDEX), row_group_size=MENTION_INDEX_ROW_GROUP)
+
+
+"""
+Returns True if a complete snapshot exists in `snapshot_dir`
+"""
+def snapshot_available(snapshot_dir=SNAPSHOT_DIR):
+    return os.path.exists(os.path.join(snapshot_dir, SNAPSHOT_META))
+
+
+"""
+Parameters
+----------
+filter : pyarrow.compute.Expression
+    Row filter, pushed down to the Parquet partitions and row groups
+snapshot_dir : str
+    Folder of the Parquet snapshot
+columns : list of str or None
+    Columns to read, only these are loaded from the Parquet files. Defaults to every column of the view.
+
+Returns
+-------
+Pandas Dataframe with the matching rows, with the same columns as the rawassignee_for_hand_labeling view (or `columns`)
+"""
+def query_snapshot(filter, snapshot_dir=SNAPSHOT_DIR, columns=None):
+    dataset = snapshot_dataset(snapshot_dir)
+    columns = [name for name in dataset.schema.names if name != PARTITION_COL and (columns is None or name in columns)]
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+
+"""
+Opened pyarrow dataset of the snapshot in `snapshot_dir`, discovered once per process and snapshot version (the
+modification time of its metadata file, which changes when the snapshot is refreshed)
+"""
+def snapshot_dataset(snapshot_dir=SNAPSHOT_DIR):
+    meta_path = os.path.join(snapshot_dir, SNAPSHOT_META)
+    return open_dataset(snapshot_dir, os.path.getmtime(meta_path) if os.path.exists(meta_path) else None)
+
+@functools.lru_cache(maxsize=4)
+def open_dataset(snapshot_dir, version):
+    return ds.dataset(snapshot_dir, format="parquet", partitioning="hive", exclude_invalid_files=True)
+
+
+"""
+Snapshot equivalent of `SELECT * FROM rawassignee_for_hand_labeling r WHERE r.assignee IN (assignee_IDs)`, as an
+iterator over Pandas Dataframes of at most `chunksize` rows (a single empty one if there are no results), read from
+the partitions of the assignee IDs only
+"""
+def snapshot_assignee_chunks(assignee_IDs, snapshot_dir=SNAPSHOT_DIR, chunksize=100_000):
+    prefixes = list({assignee_ID[0].lower() for assignee_ID in assignee_IDs})
+    filter = ds.field(PARTITION_COL).isin(prefixes) & ds.field("assignee").isin(list(assignee_IDs))
+    dataset = snapshot_dataset(snapshot_dir)
+    columns = [name for name in dataset.schema.names if name != PARTITION_COL]
+    empty = True
+    for batch in dataset.to_batches(columns=columns, filter=filter, batch_size=chunksize):
+        if batch.num_rows > 0:
+            empty = False
+            yield batch.to_pandas()
+    if empty:
+        yield dataset.schema.empty_table().select(columns).to_pandas()
+
+
+"""
+Bounds (min and max `patent_id`) of every row group of the mention index at `index_path`, read once per process and
+snapshot version
+"""
+@functools.lru_cache(maxsize=4)
+def mention_index_bounds(index_path, version):
+    metadata = pq.ParquetFile(index_path).metadata
+    column = metadata.schema.names.index("patent_id")
+    return [(metadata.row_group(i).column(column).statistics.min, metadata.row_group(i).column(column).statistics.max)
+            for i in range(metadata.num_row_groups)]
+
+
+"""
+Snapshot equivalent of the query for a single mention (patent_id, assignee_sequence) of the view. The mention index
+(see write_mention_index()) gives the row groups holding the mention, so only one row group of the index and of the
+snapshot are read. Snapshots exported without an index are scanned.
+"""
+def snapshot_mention(patent_id, assignee_sequence, snapshot_dir=SNAPSHOT_DIR):
+    patent_id = str(patent_id)
+    filter = (ds.field("patent_id") == patent_id) & (ds.field("assignee_sequence") == int(assignee_sequence))
+    index_path = os.path.join(snapshot_dir, MENTION_INDEX)
+    if not os.path.exists(index_path):
+        return query_snapshot(filter, snapshot_dir)
+
+    index = pq.ParquetFile(index_path)
+    bounds = mention_index_bounds(index_path, os.path.getmtime(index_path))
+    row_groups = [i for i, (low, high) in enumerate(bounds) if low <= patent_id <= high]
+    locations = index.read_row_groups(row_groups).filter(filter).select(["path", "row_group"]).to_pylist()
+    tables = [pq.ParquetFile(os.path.join(snapshot_dir, path)).read_row_group(row_group).filter(filter)
+              for path, row_group in dict.fromkeys((location["path"], location["row_group"]) for location in locations)]
+    if len(tables) == 0:
+        schema = snapshot_dataset(snapshot_dir).schema
+        return schema.remove(schema.get_field_index(PARTITION_COL)).empty_table().to_pandas()
+    return pa.concat_tables(tables).to_pandas()
+
+
+if __name__ == "__main__":
+    from connection import get_engine
+    export_snapshot(get_engine())
@@ -0,0 +1,141 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+import os
+
+PARQUET_EXTENSIONS = [".parquet", ".pq"]
+STRING_COLS = ['mention_id', 'patent_id', 'patent_title', 'title', 'patent_abstract', 'patent_date', 'patent_type',\
+    'assignee', 'assignee_id', 'assignee_reference_id', 'disambiguated_assignee_id', 'assignee_organization',\
+    'organization', 'assignee_individual_name_first', 'assignee_individual_name_last',\
+    'asassignee_individual_name_last', 'name_first', 'name_last', 'assignee_city', 'assignee_state', 'assignee_country']
+INTEGER_COLS = ['assignee_sequence']
+SCHEMA = {**{column: pa.string() for column in STRING_COLS}, **{column: pa.int64() for column in INTEGER_COLS}}
+CSV_DTYPES = {**{column: str for column in STRING_COLS}, **{column: "Int64" for column in INTEGER_COLS}}
+
+
+"""
+Returns "parquet" if `path` has a Parquet extension, otherwise "csv"
+"""
+def table_format(path):
+    return "parquet" if os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS else "csv"
+
+
+"""
+Parameters
+----------
+path_stem : str
+    Path without extension, such as "data/06 - compare/US5031150-0-labeler"
+
+Returns
+-------
+Path of the Parquet version of `path_stem` if it exists, otherwise of its CSV version
+"""
+def find_table(path_stem):
+    for extension in PARQUET_EXTENSIONS:
+        if os.path.exists(path_stem + extension):
+            return path_stem + extension
+    return path_stem + ".csv"
+
+
+"""
+Returns a copy of `df` with the columns of SCHEMA converted to their pandas types: IDs, names, locations and codes as
+strings (so "01234" or "NA" are never parsed as numbers) and sequences as nullable integers. Other columns are kept.
+"""
+def apply_schema(df):
+    df = df.copy()
+    for column in df.columns.intersection(STRING_COLS):
+        values = df[column].astype(object)
+        df[column] = values.where(values.isna(), values.astype(str)).where(values.notna(), None)
+    for column in df.columns.intersection(INTEGER_COLS):
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype("Int64")
+    return df
+
+
+"""
+Parameters
+----------
+df : Pandas Dataframe
+index : Boolean
+    Whether to keep the index of `df`
+
+Returns
+-------
+pyarrow Table of `df` where the columns of SCHEMA have their declared type, even if they are entirely missing
+"""
+def to_arrow(df, index=True):
+    table = pa.Table.from_pandas(apply_schema(df), preserve_index=index)
+    for i, field in enumerate(table.schema):
+        if field.name in SCHEMA and field.type != SCHEMA[field.name]:
+            table = table.set_column(i, pa.field(field.name, SCHEMA[field.name]), table.column(i).cast(SCHEMA[field.name]))
+    return table
+
+
+"""
+Parameters
+----------
+path : str
+    CSV or Parquet file, the format is chosen from the extension
+index_col : int or str
+    Column to use as the index of CSV files. Parquet files restore the index they were written with.
+columns : list of str
+    Columns to read, defaults to all
+
+Returns
+-------
+Pandas Dataframe with the columns of SCHEMA typed consistently across both formats
+"""
+def read_table(path, index_col=None, columns=None):
+    if table_format(path) == "parquet":
+        table = pq.read_table(path, columns=columns)
+        df = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    else:
+        df = pd.read_csv(path, index_col=index_col, usecols=columns, dtype=CSV_DTYPES)
+    return apply_schema(df)
+
+
+"""
+Parameters
+----------
+df : Pandas Dataframe
+output : str or file-like object
+    Output file path, or a buffer
+index : Boolean
+    Whether to write the index of `df`
+file_format : str
+    "csv" or "parquet". Defaults to the extension of `output`.
+
+Output
+------
+Writes `df` with the types of SCHEMA. Parquet files are compressed with zstd.
+"""
+def write_table(df, output, index=True, file_format=None):
+    file_format = file_format or table_format(output)
+    if file_format == "parquet":
+        pq.write_table(to_arrow(df, index), output, compression="zstd")
+    elif file_format == "csv":
+        apply_schema(df).to_csv(output, index=index)
+    else:
+        raise ValueError(f"Unsupported table format: {file_format}")
+
+
+"""
+Parameters
+----------
+chunks : iterable of Pandas Dataframes
+    Dataframes with the same columns, such as the output of connection.stream_query()
+output : str or binary file-like object
+    Output file path, or a buffer
+
+Output
+------
+Writes every chunk as a row group of a single Parquet file, so only one chunk is held in memory at a time
+"""
+def write_parquet_chunks(chunks, output):
+    writer = None
+    for chunk in chunks:
+        table = to_arrow(chunk, index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(output, table.schema, compression="zstd")
+        writer.write_table(table.cast(writer.schema))
+    if writer is not None:
+        writer.close()